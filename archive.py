@@ -0,0 +1,235 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Treat zip and tar archives as directories, so that BUGIN data can be read
+without extracting it first. A path like "wells.tar.gz/well1" means the
+"well1" directory inside "wells.tar.gz"; the archive itself is the top
+level directory.
+
+The functions here accept ordinary paths too, and then just do the usual
+thing.
+'''
+
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from os import path
+from collections import namedtuple
+
+extensions = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+              '.tar.xz', '.txz')
+
+# what ``stat`` returns for files inside archives
+_Stat = namedtuple('_Stat', ['st_size', 'st_mtime_ns'])
+
+# open archives, by path. They are shared between threads, and each one's
+# members are read under its own lock, since neither ZipFile nor TarFile can
+# be read from several threads at once
+_archives = {}
+_lock = threading.Lock()
+
+def is_archive(p):
+    '''
+    Whether p is an archive file that can be read as a directory.
+    '''
+    return p.lower().endswith(extensions) and path.isfile(p)
+
+def split(p):
+    '''
+    Split a path inside an archive into the archive file and the path of the
+    member inside it (which is '' for the top level). Returns None if p is
+    not inside an archive.
+    '''
+    head = p.rstrip('/')
+    inner = []
+    while head and head != '/':
+        if is_archive(head):
+            return head, '/'.join(reversed(inner))
+        head, tail = path.split(head)
+        if tail:
+            inner.append(tail)
+    return None
+
+def output_dir(directory, create=False):
+    '''
+    The real directory in which to write the outputs for ``directory``. For
+    a directory inside an archive, this is where it would be extracted to:
+    the archive's path without its extension, plus the path inside it. With
+    ``create`` set, it is created if it doesn't exist.
+    '''
+    s = split(directory)
+    if s is None:
+        return directory
+
+    archive, inner = s
+    base = archive
+    for ext in extensions:
+        if base.lower().endswith(ext):
+            base = base[:-len(ext)]
+            break
+
+    rtn = path.join(base, inner) if inner else base
+    if create:
+        os.makedirs(rtn, exist_ok=True)
+    return rtn
+
+def listdir(directory):
+    '''
+    ``os.listdir``, for directories inside archives too.
+    '''
+    s = split(directory)
+    if s is None:
+        return os.listdir(directory)
+    archive, inner = s
+    return _get(archive).listdir(inner)
+
+def isdir(p):
+    '''
+    ``os.path.isdir``, but true for archives and directories inside them.
+    '''
+    if path.isdir(p):
+        return True
+    s = split(p)
+    if s is None:
+        return False
+    archive, inner = s
+    return _get(archive).isdir(inner)
+
+def open(filename, mode='rb'):
+    '''
+    Open a file for reading, including one inside an archive.
+    '''
+    s = split(filename)
+    if s is None:
+        return io.open(filename, mode)
+    archive, inner = s
+    f = _get(archive).open(inner)
+    return f if 'b' in mode else io.TextIOWrapper(f)
+
+def stat(filename):
+    '''
+    The size and modification time of a file, as ``st_size`` and
+    ``st_mtime_ns``. For a file inside an archive, the modification time is
+    that of the archive, so that replacing the archive counts as changing
+    everything in it.
+    '''
+    s = split(filename)
+    if s is None:
+        return os.stat(filename)
+    archive, inner = s
+    return _Stat(_get(archive).size(inner), os.stat(archive).st_mtime_ns)
+
+def getsize(filename):
+    return stat(filename).st_size
+
+def _get(archive):
+    '''
+    The open archive at path ``archive``, reopening it if it has changed (or
+    was opened by the process this one was forked from).
+    '''
+    mtime = os.stat(archive).st_mtime_ns
+    with _lock:
+        a = _archives.get(archive)
+        if a is None or a.mtime != mtime or a.pid != os.getpid():
+            if zipfile.is_zipfile(archive):
+                a = _ZipArchive(archive)
+            else:
+                a = _TarArchive(archive)
+            a.mtime = mtime
+            a.pid = os.getpid()
+            _archives[archive] = a
+    return a
+
+class _Archive:
+    '''
+    The listing of an archive: its files, with their sizes, and the
+    directories they imply.
+    '''
+
+    def __init__(self, files):
+        # member path -> size
+        self.files = files
+        # directory -> the names of the files and directories in it
+        self.dirs = {'' : set()}
+        for name in files:
+            parts = name.split('/')
+            for i in range(len(parts)):
+                parent = '/'.join(parts[:i])
+                self.dirs.setdefault(parent, set()).add(parts[i])
+        self.lock = threading.Lock()
+
+    def listdir(self, inner):
+        if inner not in self.dirs:
+            raise FileNotFoundError('No such directory in archive: "%s"'
+                                    % inner)
+        return sorted(self.dirs[inner])
+
+    def isdir(self, inner):
+        return inner in self.dirs
+
+    def open(self, inner):
+        '''
+        Read a member into memory, so that threads don't have to take turns
+        reading from it.
+        '''
+        self.size(inner)
+        with self.lock:
+            return io.BytesIO(self._read(inner))
+
+    def size(self, inner):
+        if inner not in self.files:
+            raise FileNotFoundError('No such file in archive: "%s"' % inner)
+        return self.files[inner]
+
+class _ZipArchive(_Archive):
+
+    def __init__(self, filename):
+        self.zf = zipfile.ZipFile(filename)
+        super().__init__({i.filename.rstrip('/') : i.file_size
+                          for i in self.zf.infolist() if not i.is_dir()})
+
+    def _read(self, inner):
+        return self.zf.read(inner)
+
+class _TarArchive(_Archive):
+
+    def __init__(self, filename):
+        self.tf = tarfile.open(filename)
+        self.members = {}
+        for m in self.tf.getmembers():
+            if m.isfile():
+                self.members[m.name.removeprefix('./')] = m
+        super().__init__({k : m.size for k, m in self.members.items()})
+
+        # seeking backwards in a compressed archive means decompressing it
+        # again from the start, so the members of a directory are read
+        # together, in the order they're stored, and kept until another
+        # directory is read
+        self.compressed = not filename.lower().endswith('.tar')
+        self._batch_dir = None
+        self._batch = {}
+
+    def _read(self, inner):
+        if not self.compressed:
+            return self._extract(inner)
+
+        parent = inner.rpartition('/')[0]
+        if parent != self._batch_dir:
+            self._batch_dir = parent
+            self._batch = {}
+            names = [parent + '/' + n if parent else n
+                     for n in self.dirs[parent]]
+            names = [n for n in names if n in self.members]
+            for name in sorted(names,
+                               key=lambda n: self.members[n].offset_data):
+                self._batch[name] = self._extract(name)
+        return self._batch[inner]
+
+    def _extract(self, inner):
+        with self.tf.extractfile(self.members[inner]) as f:
+            return f.read()
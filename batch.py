@@ -0,0 +1,91 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Run per-directory work, serially or spread over a process pool.
+'''
+
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import stats
+
+def map_directories(func, dirs, jobs=1, **kwargs):
+    '''
+    Call ``func(directory, **kwargs)`` for every directory in ``dirs``.
+
+    Parameters
+    ----------
+
+    func : function
+        The work to do for each directory. Must be defined at the top level
+        of a module, so that it can be sent to worker processes.
+
+    dirs : iterable of str
+        The directories to process. May be a generator (e.g. from
+        ``discover.find_directories``); work starts on each directory as soon
+        as it is produced.
+
+    jobs : int
+        How many processes to use. With 1, everything runs in this process.
+
+    Yields
+    ------
+
+    tuple
+        ``(directory, result)`` pairs, in the same order as ``dirs``. Anything
+        ``func`` prints (i.e. warnings) for a directory is printed just before
+        that directory's result is yielded, so the output is the same as for a
+        serial run.
+
+    If statistics are being collected (see ``stats.collect``), those from
+    worker processes are merged in too.
+    '''
+
+    if jobs <= 1:
+        for d in dirs:
+            with stats.directory(d):
+                result = func(d, **kwargs)
+            yield d, result
+        return
+
+    collecting = stats.active() is not None
+
+    def finish(d, future):
+        result, output, worker_stats = future.result()
+        print(output, end='')
+        if worker_stats is not None:
+            stats.active().merge(worker_stats)
+        return d, result
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for d in dirs:
+            pending.append((d, pool.submit(_run_captured, func, d, kwargs,
+                                           collecting)))
+
+            # hand back whatever has finished, without getting out of order
+            while pending and pending[0][1].done():
+                yield finish(*pending.popleft())
+
+        while pending:
+            yield finish(*pending.popleft())
+
+def _run_captured(func, directory, kwargs, collecting=False):
+    '''
+    Run ``func`` on a directory in a worker process, capturing its output
+    (and its statistics, if ``collecting`` is set).
+    '''
+    out = io.StringIO()
+    with redirect_stdout(out):
+        if collecting:
+            with stats.collect() as s, stats.directory(directory):
+                result = func(directory, **kwargs)
+            return result, out.getvalue(), s.to_dict()
+
+        result = func(directory, **kwargs)
+    return result, out.getvalue(), None
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Benchmark BUGOUT on synthetic data, and compare the results between runs to
+catch performance regressions.
+'''
+
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+from os import path, stat
+from argparse import ArgumentParser
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import cache
+from synth import make_dataset
+from file_read import read_bugin, binary_types, ascii_types
+from file_write import combine, parse_and_write, gen_master_samples
+
+def run(dirs, repeat=3, memory=True):
+    '''
+    Time BUGOUT's main entry points on the BUGIN directories ``dirs``.
+
+    Parameters
+    ----------
+
+    dirs : list of str
+        The directories to run on. Output files are written into them.
+
+    repeat : int
+        How many times to run each stage; the fastest time is kept.
+
+    memory : bool
+        Whether to also run each stage once under ``tracemalloc``, to record
+        its peak Python heap use. That leaves out memory-mapped input files,
+        whose pages only show up in the process's RSS (see "max_rss_mb" in
+        the results' "meta").
+
+    Returns
+    -------
+
+    dict
+        For each stage, its time in seconds, the number of records and bytes
+        of input it processed, the resulting throughput, and its peak Python
+        heap use in MB.
+    '''
+
+    file_types = list(binary_types) + list(ascii_types)
+    inputs = [(d, ft) for d in dirs for ft in file_types
+              if path.isfile(path.join(d, ft))]
+
+    def size(ftypes):
+        return sum(stat(path.join(d, ft)).st_size
+                   for d, ft in inputs if ft in ftypes)
+
+    def records(ftypes):
+        return sum(len(read_bugin(d, ft)[0])
+                   for d, ft in inputs if ft in ftypes)
+
+    master = path.join(path.dirname(dirs[0]), 'bench_master.csv')
+    combined = ['SAMPLES', 'SAMPLE2', 'SPECIES', 'ABUNDAN', 'HEADER']
+
+    stages = {}
+    for ft in file_types:
+        stages['read_bugin %s' % ft] = (
+            lambda ft=ft: [read_bugin(d, f) for d, f in inputs if f == ft],
+            [ft])
+
+    stages['parse_and_write'] = (lambda: [parse_and_write(d) for d in dirs],
+                                 file_types)
+    stages['combine'] = (lambda: [combine(d) for d in dirs], combined)
+    stages['gen_master_samples'] = (
+        lambda: gen_master_samples(dirs, master, force=True),
+        ['SAMPLES', 'SAMPLE2', 'HEADER'])
+
+    results = {}
+    for name, (func, ftypes) in stages.items():
+        n_records = records(ftypes)
+        n_bytes = size(ftypes)
+        if not n_bytes:
+            continue
+
+        best = min(_time(func) for _ in range(repeat))
+        results[name] = {
+            'seconds' : best,
+            'records' : n_records,
+            'bytes' : n_bytes,
+            'records_per_s' : n_records/best,
+            'mb_per_s' : n_bytes/best/1e6,
+        }
+
+        if memory:
+            cache.invalidate()
+            tracemalloc.start()
+            func()
+            results[name]['heap_peak_mb'] = tracemalloc.get_traced_memory()[1]/1e6
+            tracemalloc.stop()
+
+    return results
+
+def _time(func):
+    # time the parsing, not the cache
+    cache.invalidate()
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+def compare(old, new, threshold=0.1):
+    '''
+    Print how each stage's time changed between two sets of results, flagging
+    those that got slower by more than ``threshold`` (a fraction).
+
+    Returns
+    -------
+
+    bool
+        Whether any stage regressed.
+    '''
+
+    regressed = False
+    for name, r in new['stages'].items():
+        if name not in old['stages']:
+            continue
+        ratio = r['seconds'] / old['stages'][name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- SLOWER'
+            regressed = True
+        print('%-24s %9.4fs -> %9.4fs  (x%.2f)%s'
+              % (name, old['stages'][name]['seconds'], r['seconds'], ratio, flag))
+    return regressed
+
+def print_results(results):
+    print('%-24s %10s %14s %10s %10s' % ('stage', 'seconds', 'records/s',
+                                         'MB/s', 'heap MB'))
+    for name, r in results.items():
+        print('%-24s %10.4f %14.0f %10.2f %10s'
+              % (name, r['seconds'], r['records_per_s'], r['mb_per_s'],
+                 '%.1f' % r['heap_peak_mb'] if 'heap_peak_mb' in r
+                 else '-'))
+
+if __name__ == '__main__':
+    p = ArgumentParser(description='Benchmark BUGOUT on synthetic data.')
+
+    p.add_argument('-o', '--output', type=str, metavar='FILE',
+                   help = 'Save the results to this JSON file.')
+
+    p.add_argument('--compare', type=str, metavar='FILE',
+                   help = 'Compare the results to those saved in this file.')
+
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help = 'Fractional slowdown that counts as a regression, '
+                          'for --compare.')
+
+    p.add_argument('--wells', type=int, default=4,
+                   help = 'Number of well directories to generate.')
+
+    p.add_argument('--samples', type=int, default=500,
+                   help = 'Number of samples per well.')
+
+    p.add_argument('--species', type=int, default=500,
+                   help = 'Number of species per well.')
+
+    p.add_argument('--abundance', type=int, default=50000,
+                   help = 'Number of abundance records per well.')
+
+    p.add_argument('--repeat', type=int, default=3,
+                   help = 'Number of times to run each stage.')
+
+    p.add_argument('--no-memory', action = 'store_true',
+                   help = 'Skip measuring peak Python heap use.')
+
+    args = p.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bugout_bench_')
+    try:
+        dirs = make_dataset(root, args.wells, n_samples=args.samples,
+                            n_species=args.species,
+                            n_abundance=args.abundance)
+        results = {
+            'meta' : {
+                'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python' : platform.python_version(),
+                'platform' : platform.platform(),
+                'wells' : args.wells,
+                'samples' : args.samples,
+                'species' : args.species,
+                'abundance' : args.abundance,
+            },
+            'stages' : run(dirs, repeat=args.repeat, memory=not args.no_memory),
+        }
+    finally:
+        shutil.rmtree(root)
+
+    if resource is not None:
+        # ru_maxrss is in kB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results['meta']['max_rss_mb'] = rss/1e3
+
+    print_results(results['stages'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print()
+        if compare(old, results, args.threshold):
+            exit(1)
@@ -0,0 +1,169 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Keep recently parsed BUGIN files in memory, for programs that use BUGOUT as
+a library and read the same directories over and over. An entry is keyed by
+the file's path, size and modification time (plus whatever else affects the
+result, such as filters), so a file that changes on disk is simply parsed
+again:
+
+    cache.configure(512<<20)
+    read_bugin(directory, 'SPECIES')  # parsed
+    read_bugin(directory, 'SPECIES')  # from the cache
+    cache.info()                      # CacheInfo(hits=1, misses=1, ...)
+
+Cached values are shared between callers, and must not be modified.
+'''
+
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+import archive
+
+# the most memory (roughly, in bytes) that cached values may take up
+MAX_BYTES = 128<<20
+
+# how many elements of a list to measure when estimating its size
+SAMPLE = 32
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'bytes',
+                                     'max_bytes'])
+
+# key -> (value, size), least recently used first
+_entries = OrderedDict()
+_lock = threading.Lock()
+_max_bytes = MAX_BYTES
+_bytes = 0
+_hits = 0
+_misses = 0
+
+def configure(max_bytes=MAX_BYTES):
+    '''
+    Set the memory bound of the cache, evicting entries if it's now over.
+    A bound of 0 turns caching off.
+    '''
+    global _max_bytes
+    with _lock:
+        _max_bytes = max_bytes
+        _evict()
+
+def info():
+    '''
+    The hit and miss counts, and the number and total size of the entries.
+    '''
+    with _lock:
+        return CacheInfo(_hits, _misses, len(_entries), _bytes, _max_bytes)
+
+def invalidate(filename=None):
+    '''
+    Forget the cached results for filename, or everything if it's None. The
+    hit and miss counts are only reset when everything is forgotten.
+    '''
+    global _bytes, _hits, _misses
+    with _lock:
+        if filename is None:
+            _entries.clear()
+            _bytes = _hits = _misses = 0
+            return
+        for k in [k for k in _entries if k[0] == filename]:
+            _bytes -= _entries.pop(k)[1]
+
+def get(filename, key):
+    '''
+    The cached value for ``key`` of filename, as it is now on disk, or None.
+    '''
+    k = _key(filename, key)
+    if k is None:
+        return None
+    return _lookup(k)
+
+def cached(filename, key, load):
+    '''
+    The value for ``key`` of filename, calling ``load()`` to compute it if it
+    isn't cached (or the file has changed since it was).
+
+    Parameters
+    ----------
+
+    filename : str
+        The file the value is computed from.
+
+    key : hashable
+        Anything other than the file that the value depends on, e.g. which
+        fields were decoded.
+
+    load : function
+        Computes the value.
+    '''
+    k = _key(filename, key)
+    if k is None:
+        return load()
+
+    rtn = _lookup(k)
+    if rtn is not None:
+        return rtn
+
+    rtn = load()
+    _insert(k, rtn)
+    return rtn
+
+def _key(filename, key):
+    if not _max_bytes:
+        return None
+    try:
+        st = archive.stat(filename)
+    except OSError:
+        # let the loader report it
+        return None
+    return (filename, st.st_size, st.st_mtime_ns, key)
+
+def _lookup(k):
+    global _hits, _misses
+    with _lock:
+        entry = _entries.get(k)
+        if entry is None:
+            _misses += 1
+            return None
+        _entries.move_to_end(k)
+        _hits += 1
+        return entry[0]
+
+def _insert(k, value):
+    global _bytes
+    size = sizeof(value)
+    with _lock:
+        if size > _max_bytes:
+            # would push everything else out
+            return
+        # older versions of the file won't be asked for again
+        for old in [o for o in _entries if o[0] == k[0] and o[3] == k[3]]:
+            _bytes -= _entries.pop(old)[1]
+        _entries[k] = (value, size)
+        _bytes += size
+        _evict()
+
+def _evict():
+    global _bytes
+    while _bytes > _max_bytes and _entries:
+        _bytes -= _entries.popitem(last=False)[1][1]
+
+def sizeof(value):
+    '''
+    Estimate the memory taken up by value, including what it contains.
+    Long lists are estimated from a sample of their elements.
+    '''
+    rtn = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        n = len(value)
+        if n > SAMPLE:
+            step = n / SAMPLE
+            sample = [value[int(i*step)] for i in range(SAMPLE)]
+            return rtn + sum(sizeof(v) for v in sample) * n // SAMPLE
+        return rtn + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return rtn + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    return rtn
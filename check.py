@@ -0,0 +1,179 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Scan directories for problems without converting them: missing files,
+partial records, fields that won't decode, pointers out of range and a
+misaligned SAMPLE2. Only the fields that are needed are looked at, and
+nothing is written but the report, one JSON object per directory:
+
+    for report in check_directories(dirs, jobs=8):
+        print(report['directory'], report['ok'])
+'''
+
+from os import path
+
+from archive import listdir
+from file_read import open_bugin, read_ascii_file, read_user_file
+from file_read import convert_fields, binary_types, ascii_types, user_types
+from batch import map_directories
+import archive
+import stats
+
+# the files ``combine`` needs; SAMPLES and HEADER are enough for the samples
+# alone
+REQUIRED = ['SAMPLES', 'HEADER', 'SPECIES', 'ABUNDAN']
+
+# the counters that mean something is wrong
+PROBLEMS = [
+    'partial_record_bytes',
+    'ascii_decode_failures',
+    'bad_floats',
+    'species_pointers_out_of_range',
+    'samples_pointers_out_of_range',
+    'sample2_misalignment',
+]
+
+def check_directories(dirs, jobs=1):
+    '''
+    Check each of dirs with ``check_directory``, using ``jobs`` processes,
+    and yield the reports in order.
+    '''
+    for _, report in map_directories(check_directory, dirs, jobs):
+        yield report
+
+def check_directory(directory):
+    '''
+    Check one directory's BUGIN files.
+
+    Returns
+    -------
+
+    dict
+        The report, with keys:
+
+        ``directory``
+            The directory.
+        ``missing``
+            Which of the files ``combine`` needs are missing.
+        ``files``
+            For each BUGIN file present, its size ("bytes"), number of
+            records, and the counts of ``stats.COUNTERS`` that apply to it.
+            Decoding problems are counted in whole records; the bytes of a
+            trailing partial record are counted as "partial_record_bytes".
+            A file that couldn't be read at all has an "error" instead.
+        ``ok``
+            Whether nothing is missing and all the ``PROBLEMS`` counts are 0.
+    '''
+
+    present = listdir(directory)
+    known = list(binary_types) + list(ascii_types) + list(user_types)
+
+    outer = stats.active()
+    with stats.collect() as s:
+        errors = {}
+        for ftype in [f for f in known if f in present]:
+            fname = path.join(directory, ftype)
+            stats.reading(fname)
+            try:
+                _check_file(directory, ftype)
+            except (OSError, ValueError) as e:
+                errors[fname] = '%s: %s' % (type(e).__name__, e)
+
+        if all(f in present for f in ['SPECIES', 'SAMPLES', 'ABUNDAN']):
+            try:
+                _check_pointers(directory)
+            except (OSError, ValueError) as e:
+                errors.setdefault(path.join(directory, 'ABUNDAN'),
+                                  '%s: %s' % (type(e).__name__, e))
+
+        if 'SAMPLES' in present and 'SAMPLE2' in present:
+            try:
+                n_samples = _records(directory, 'SAMPLES')
+                n_sample2 = _records(directory, 'SAMPLE2')
+            except (OSError, ValueError):
+                # already reported above
+                pass
+            else:
+                stats.count(path.join(directory, 'SAMPLE2'),
+                            'sample2_misalignment',
+                            abs(n_sample2 - (n_samples-1)))
+
+    if outer is not None:
+        outer.merge(s)
+
+    files = {}
+    for fname, counts in s.files.items():
+        name = path.basename(fname)
+        files[name] = {k : counts[k] for k in ['bytes', 'records'] + PROBLEMS}
+    for fname, error in errors.items():
+        files[path.basename(fname)] = {'error' : error}
+
+    missing = [f for f in REQUIRED if f not in present]
+    ok = not missing and not errors and \
+         not any(c.get(k) for c in files.values() for k in PROBLEMS)
+
+    return {
+        'directory' : directory,
+        'ok' : ok,
+        'missing' : missing,
+        'files' : files,
+    }
+
+def _check_file(directory, ftype):
+    '''
+    Count the decoding problems in one file, and its size and records.
+    '''
+    fname = path.join(directory, ftype)
+
+    if ftype in binary_types:
+        # counts the bytes and partial record bytes too
+        with open_bugin(directory, ftype) as f:
+            f.count_failures()
+            stats.count(fname, 'records', len(f))
+        return
+
+    # the text files are small, so just read them
+    if ftype in ascii_types:
+        records = read_ascii_file(fname, **ascii_types[ftype])
+    else:
+        records, _ = read_user_file(fname,
+                                    **convert_fields(binary_types['SPECIES']))
+    stats.count(fname, 'bytes', archive.getsize(fname))
+    stats.count(fname, 'records', len(records))
+
+def _check_pointers(directory):
+    '''
+    Count the ABUNDAN records that point past the end of SPECIES or SAMPLES,
+    decoding only the pointers.
+    '''
+    n_species = _records(directory, 'SPECIES')
+    n_samples = _records(directory, 'SAMPLES')
+
+    bad_species = bad_samples = 0
+    # the file's size and records were already counted by _check_file
+    with stats.collect(), \
+         open_bugin(directory, 'ABUNDAN', ['Pointer to SPECIES File',
+                                           'Pointer to SAMPLES File']) as f:
+        # the first record isn't data
+        for d in f[1:].decoded():
+            d = dict(d)
+            # a partial record may be cut off before its pointers
+            if d.get('Pointer to SPECIES File', 0) >= n_species:
+                bad_species += 1
+            if d.get('Pointer to SAMPLES File', 0) >= n_samples:
+                bad_samples += 1
+
+    abund_file = path.join(directory, 'ABUNDAN')
+    stats.count(abund_file, 'species_pointers_out_of_range', bad_species)
+    stats.count(abund_file, 'samples_pointers_out_of_range', bad_samples)
+
+def _records(directory, ftype):
+    '''
+    The number of records in a binary file, counting a trailing partial one,
+    as ``combine`` does.
+    '''
+    rl = binary_types[ftype]['record_length']
+    return -(-archive.getsize(path.join(directory, ftype)) // rl)
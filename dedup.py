@@ -0,0 +1,140 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Spot directories whose BUGIN files are copies of another's (backups,
+re-exports and so on), so that each dataset is only converted once:
+
+    d = Deduplicator(['SAMPLES', 'SAMPLE2', 'HEADER'])
+    for directory in d.unique(dirs):
+        combine(directory)
+    d.write('duplicates.csv')
+
+Directories are compared by the sizes of their files first, and only hashed
+(reading each file once, in chunks) when those match an earlier directory's,
+so directories without a copy are never read.
+'''
+
+import hashlib
+from os import path, remove
+
+import archive
+from sinks import create
+
+# the columns of the duplicates file
+FIELDS = ['Directory', 'Duplicate of']
+
+# the duplicates file for conversions that don't have an output file of
+# their own to go next to, in the current directory, by run (see
+# ``journal.run_id``)
+DUPLICATES_NAME = 'bugout_duplicates_%s'
+
+class Deduplicator:
+    '''
+    Find the directories whose files ``names`` are the same as those of a
+    directory seen before them.
+
+    Parameters
+    ----------
+
+    names : list of str
+        The files to compare. Directories only match if they have the same
+        ones of these.
+    '''
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        # (name, size) pairs -> [directory, content hash or None] entries of
+        # the directories seen with those sizes
+        self._seen = {}
+        # (directory, the earlier directory it's a copy of)
+        self.duplicates = []
+
+    def original(self, directory):
+        '''
+        The earlier directory that ``directory`` is a copy of, or None if it
+        isn't one. Either way, it counts as seen for later directories.
+        '''
+        sig = signature(directory, self.names)
+        if not sig:
+            # nothing to compare; let the conversion complain
+            return None
+
+        entries = self._seen.setdefault(sig, [])
+        if entries:
+            h = dataset_hash(directory, [name for name, _ in sig])
+            for entry in entries:
+                if entry[1] is None:
+                    entry[1] = dataset_hash(entry[0],
+                                            [name for name, _ in sig])
+                if entry[1] == h:
+                    self.duplicates.append((directory, entry[0]))
+                    return entry[0]
+        else:
+            h = None
+
+        entries.append([directory, h])
+        return None
+
+    def unique(self, dirs):
+        '''
+        Yield the directories of dirs that aren't copies of earlier ones.
+        '''
+        for d in dirs:
+            if self.original(d) is None:
+                yield d
+
+    def write(self, filename, format='csv'):
+        '''
+        List the duplicate directories found so far, and what they're copies
+        of, in filename (in output format ``format``), and say so. If there
+        aren't any, a duplicates file left from before is removed, so
+        filename must belong to this conversion alone (see ``sidecar`` and
+        ``DUPLICATES_NAME``).
+        '''
+        if not self.duplicates:
+            if path.isfile(filename):
+                remove(filename)
+            return
+
+        with create(filename, FIELDS, format) as sink:
+            sink.write_rows(self.duplicates)
+        print('Skipped %d directories with the same BUGIN files as others; '
+              'they are listed in "%s".' % (len(self.duplicates), filename))
+
+def sidecar(filename, format='csv'):
+    '''
+    The duplicates file to go with the output file filename.
+    '''
+    ext = '.' + format
+    if filename.endswith(ext):
+        filename = filename[:-len(ext)]
+    return filename + '_duplicates' + ext
+
+def signature(directory, names):
+    '''
+    The ``(name, size)`` of each of the files ``names`` present in directory.
+    '''
+    rtn = []
+    for name in names:
+        try:
+            rtn.append((name, archive.getsize(path.join(directory, name))))
+        except OSError:
+            continue
+    return tuple(rtn)
+
+def dataset_hash(directory, names, chunk_size=1<<20):
+    '''
+    SHA-1 of the names and contents of the files ``names`` in directory,
+    read in chunks of ``chunk_size`` bytes.
+    '''
+    h = hashlib.sha1()
+    for name in names:
+        h.update(name.encode() + b'\0')
+        with archive.open(path.join(directory, name)) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        h.update(b'\0')
+    return h.hexdigest()
@@ -0,0 +1,84 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Find BUGIN directories anywhere under a root directory.
+'''
+
+from os import scandir, path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import archive
+from file_read import binary_types, ascii_types, user_types
+
+bugin_files = set(binary_types) | set(ascii_types) | set(user_types)
+
+# listing directories is I/O-bound, so use plenty of threads; this mostly
+# helps on network filesystems
+THREADS = 16
+
+def find_directories(root, required=('SAMPLES', 'HEADER'), threads=THREADS):
+    '''
+    Walk the tree under root, yielding BUGIN directories as they are found.
+    The order is not deterministic. Symbolic links to directories are not
+    followed. Archives (see ``archive``) are searched like directories.
+
+    Parameters
+    ----------
+
+    root : str
+        The top of the tree.
+
+    required : tuple of str
+        The files a directory must contain to be yielded. If empty, any
+        directory containing at least one BUGIN file is yielded.
+
+    threads : int
+        The number of directories to list at once.
+    '''
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = {pool.submit(_scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, files, subdirs = future.result()
+
+                if required:
+                    found = all(f in files for f in required)
+                else:
+                    found = not bugin_files.isdisjoint(files)
+                if found:
+                    yield directory
+
+                pending.update(pool.submit(_scan, d) for d in subdirs)
+
+def _scan(directory):
+    '''
+    List a directory's files and subdirectories (including archives).
+    '''
+
+    files, subdirs = set(), []
+    try:
+        if archive.split(directory) is not None:
+            for name in archive.listdir(directory):
+                p = path.join(directory, name)
+                if archive.isdir(p):
+                    subdirs.append(p)
+                else:
+                    files.add(name)
+        else:
+            with scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) or \
+                       archive.is_archive(entry.path):
+                        subdirs.append(entry.path)
+                    else:
+                        files.add(entry.name)
+    except OSError as e:
+        print('Warning: could not read directory "%s" (%s). Skipping...'
+              % (directory, e.strerror))
+
+    return directory, files, subdirs
@@ -0,0 +1,166 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Vectorized, column-oriented reading of BUGIN binary files with NumPy.
+NumPy is optional; everything else in BUGOUT works without it.
+'''
+
+from os import path
+import archive
+from file_read import binary_types, convert_fields, parse_format_string
+from file_read import compile_codec
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def read_bugin_columns(directory, file_type):
+    '''
+    Read a BUGIN binary file into columns, one NumPy array per field.
+
+    Parameters
+    ----------
+
+    directory : str
+        The directory to read from
+
+    file_type : str
+        Which file to read. Must be one of the keys of ``binary_types``.
+
+    Returns
+    -------
+
+    dict
+        Field name to array, in file order. ``I`` fields are integer arrays,
+        ``F`` fields are float arrays and ``A`` fields are fixed-width byte
+        strings.
+    '''
+
+    if file_type not in binary_types:
+        raise ValueError('Cannot read %s into columns; only binary file '
+                         'types are supported' % file_type)
+
+    d = convert_fields(binary_types[file_type])
+    return read_binary_columns(path.join(directory, file_type), **d)
+
+def read_binary_columns(filename, field_names, format_spec, record_length):
+    '''
+    Read a BUGIN file unformatted binary format into columns.
+
+    The values match those from ``read_binary_file``: integers are
+    little-endian, ASCII fields are stripped (and empty if they are not valid
+    ASCII), and floats that can't be parsed are -1. The only difference is
+    that NumPy drops trailing NUL bytes from byte strings.
+
+    Parameters
+    ----------
+    filename : str
+        The file path
+
+    field_names : list
+        A list of the names for the corresponding fields in format_spec.
+
+    format_spec : str
+        A FORTRAN format string.
+
+    record_length : int
+        The number of bytes in a record.
+    '''
+
+    if np is None:
+        raise ImportError('NumPy is required to read BUGIN files into columns')
+
+    dtype, types = record_dtype(format_spec, field_names, record_length)
+    codec = compile_codec(format_spec, field_names, record_length)
+
+    with archive.open(filename) as f:
+        b = f.read()
+
+    n_full = len(b) // record_length
+    records = np.frombuffer(b, dtype=dtype, count=n_full)
+
+    rtn = {}
+    for name in dtype.names:
+        rtn[name] = _convert_column(records[name], types[name],
+                                    codec.slices[name][2])
+
+    # a trailing partial record is decoded the slow way, just like
+    # read_binary_file does
+    if n_full*record_length < len(b):
+        tail = dict(codec.decode(b, n_full*record_length))
+        for name, col in rtn.items():
+            val = tail[name]
+            if types[name] == 'A':
+                val = val.encode('ASCII')
+            rtn[name] = np.append(col, np.array([val], dtype=col.dtype))
+
+    return rtn
+
+def record_dtype(format_spec, field_names, record_length):
+    '''
+    Build a NumPy structured dtype for a binary record layout. ``X`` fields
+    and the uninitialized bytes at the end of the record are left out.
+
+    Returns
+    -------
+
+    numpy.dtype
+        The structured dtype, with itemsize ``record_length``.
+
+    dict
+        The format type character (A, I or F) of each field.
+    '''
+
+    if np is None:
+        raise ImportError('NumPy is required to read BUGIN files into columns')
+
+    names, formats, offsets = [], [], []
+    types = {}
+    offset = 0
+    for fmt, name in zip(parse_format_string(format_spec), field_names):
+        size = fmt['size']
+        if fmt['type'] != 'X':
+            names.append(name)
+            offsets.append(offset)
+            types[name] = fmt['type']
+            if fmt['type'] == 'I' and size in (1, 2, 4, 8):
+                formats.append('<u%d' % size)
+            else:
+                formats.append('V%d' % size)
+        offset += size
+
+    dtype = np.dtype({'names' : names, 'formats' : formats,
+                      'offsets' : offsets, 'itemsize' : record_length})
+    return dtype, types
+
+def _convert_column(raw, fmt_type, converter):
+    '''
+    Convert a column of raw field values to its final array type.
+    '''
+
+    if fmt_type == 'I':
+        if raw.dtype.kind == 'u':
+            return raw.astype(np.int64)
+
+        # odd-sized integers (e.g. I7): little-endian sum of the bytes
+        size = raw.dtype.itemsize
+        u = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(-1, size)
+        weights = np.uint64(1) << (np.uint64(8)*np.arange(size, dtype=np.uint64))
+        return (u.astype(np.uint64) @ weights).astype(np.int64)
+
+    # ASCII strings and floats repeat a lot, so run the scalar conversion
+    # once per distinct value rather than once per record
+    uniq, inv = np.unique(raw, return_inverse=True)
+    vals = [converter(bytes(u)) for u in uniq]
+
+    if fmt_type == 'A':
+        out = np.array([v.encode('ASCII') for v in vals],
+                       dtype='S%d' % raw.dtype.itemsize)
+    else:
+        out = np.array(vals, dtype=np.float64)
+
+    return out[inv.reshape(-1)]
@@ -3,12 +3,21 @@ This file is part of BUGOUT
 (c) Greg Meyer, 2018
 '''
 
+import io
+import mmap
+import struct
 from os import path
-from functools import partial
+from itertools import chain
+
+import archive
+import cache
+import filters
+import prefetch
+import stats
 
 DEBUG = False
 
-def read_bugin(directory, file_type):
+def read_bugin(directory, file_type, stream=False, where=None, fields=None):
     '''
     Actually read in bugin files!
 
@@ -21,12 +30,61 @@ def read_bugin(directory, file_type):
     file_type : str
         Which file to read. Options are the keys of the dictionaries containing
         the format definitions (at the bottom of this file).
+
+    stream : bool
+        If set, return a generator that yields the records as they are read,
+        instead of a list. Only binary files are actually read incrementally;
+        the others are small.
+
+    where : list of tuple
+        For binary files, only return records that pass these
+        ``(field name, test)`` conditions (see ``filters``). The fields being
+        tested are decoded first, and the rest of the record only if the
+        tests pass.
+
+    fields : iterable of str
+        If given, only return these fields of each record (those that are
+        in this file type, at least). For binary files, the others aren't
+        decoded at all.
+
+    Results are kept in ``cache`` until the file changes, and are shared
+    between callers, so they must not be modified. Streamed files are only
+    read from the cache, never added to it, so that they are never held in
+    memory all at once. Reads with tests other than those in ``filters``
+    aren't cached.
+    '''
+
+    fname = path.join(directory, file_type)
+    where_key = filters.cache_key(where)
+    if where_key is None:
+        return _read_bugin(directory, file_type, stream, where, fields)
+
+    key = (file_type, where_key,
+           None if fields is None else frozenset(fields))
+
+    if stream:
+        hit = cache.get(fname, key)
+        if hit is not None:
+            return iter(hit[0]), hit[1]
+        return _read_bugin(directory, file_type, True, where, fields)
+
+    return cache.cached(fname, key,
+                        lambda: _read_bugin(directory, file_type, False,
+                                            where, fields))
+
+def _read_bugin(directory, file_type, stream, where, fields):
+    '''
+    Read a BUGIN file, for ``read_bugin``.
     '''
 
     if file_type in binary_types:
         extra_data = None
         d = convert_fields(binary_types[file_type])
-        rtn = read_binary_file(path.join(directory, file_type), **d)
+        if stream:
+            return iter_binary_file(path.join(directory, file_type), **d,
+                                    where=where, fields=fields), None
+        rtn = read_binary_file(path.join(directory, file_type), **d,
+                               where=where, fields=fields)
 
     elif file_type in ascii_types:
         extra_data = None
@@ -40,6 +98,18 @@ def read_bugin(directory, file_type):
     else:
         raise ValueError('Unrecognized file type %s' % file_type)
 
+    if file_type not in binary_types and stats.active() is not None:
+        fname = path.join(directory, file_type)
+        stats.count(fname, 'bytes', archive.getsize(fname))
+        stats.count(fname, 'records', len(rtn))
+
+    if file_type not in binary_types and fields is not None:
+        fields = set(fields)
+        rtn = [[(k, v) for k, v in r if k in fields] for r in rtn]
+
+    if stream:
+        rtn = iter(rtn)
+
     return rtn, extra_data
 
 def read_user_file(filename, field_names, format_spec, record_length):
@@ -64,7 +134,7 @@ def read_user_file(filename, field_names, format_spec, record_length):
     contents = []
     field_names = [n for n in field_names if n]
 
-    with open(filename, 'r') as f:
+    with _open(filename, 'r') as f:
         # get through the initial header part
         f.readline()
         qualifiers = []
@@ -96,7 +166,7 @@ def read_ascii_file(filename, field_names):
         The number of bytes in a record.
     '''
 
-    with open(filename) as f:
+    with _open(filename, 'r') as f:
         rtn = [[]]
         n_fields = len(field_names)
         lines = f.readlines()
@@ -108,7 +178,8 @@ def read_ascii_file(filename, field_names):
                       rtn[0][-1][1] + ' '.join(l.strip() for l in lines[n_fields:]))
     return rtn
 
-def read_binary_file(filename, field_names, format_spec, record_length):
+def read_binary_file(filename, field_names, format_spec, record_length,
+                     where=None, fields=None):
     '''
     Read a BUGIN file unformatted binary format.
 
@@ -125,18 +196,108 @@ def read_binary_file(filename, field_names, format_spec, record_length):
 
     record_length : int
         The number of bytes in a record.
+
+    where : list of tuple
+        Only decode the records that pass these ``(field name, test)``
+        conditions.
+
+    fields : iterable of str
+        Only decode these fields.
     '''
 
-    contents = []
+    codec = compile_codec(format_spec, field_names, record_length, fields)
+
+    with _open(filename, 'rb') as f:
+        b = f.read()
+
+    stats.reading(filename)
+    rtn = codec.decode_all(b, where)
+
+    n = -(-len(b) // record_length)
+    stats.count(filename, 'bytes', len(b))
+    stats.count(filename, 'records', n)
+    stats.count(filename, 'records_filtered', n - len(rtn))
+    stats.count(filename, 'partial_record_bytes', len(b) % record_length)
+
+    return rtn
+
+def iter_binary_file(filename, field_names, format_spec, record_length,
+                     chunk_records=4096, where=None, fields=None):
+    '''
+    Read a BUGIN file unformatted binary format, yielding one record at a time.
+    Only ``chunk_records`` records are held in memory at once.
+
+    Parameters
+    ----------
+    filename : str
+        The file path
+
+    field_names : list
+        A list of the names for the corresponding fields in format_spec.
+
+    format_spec : str
+        A FORTRAN format string.
+
+    record_length : int
+        The number of bytes in a record.
+
+    chunk_records : int
+        How many records to read from disk at a time.
 
-    with open(filename, 'rb') as f:
-        #f.seek(record_length)
-        for chunk in iter(partial(f.read, record_length), ''):
-            if not chunk:
+    where : list of tuple
+        Only decode the records that pass these ``(field name, test)``
+        conditions.
+
+    fields : iterable of str
+        Only decode these fields.
+    '''
+
+    codec = compile_codec(format_spec, field_names, record_length, fields)
+    passes = codec.matcher(where)
+
+    with _open(filename, 'rb') as f:
+        rest = b''
+        while True:
+            b = f.read(chunk_records*record_length)
+            if not b:
                 break
-            contents.append(bytes_to_list(chunk, format_spec, field_names))
+            stats.count(filename, 'bytes', len(b))
+            if rest:
+                b = rest + b
+
+            end = len(b) - len(b) % record_length
+            stats.reading(filename)
+            stats.count(filename, 'records', end // record_length)
+            if passes is None:
+                yield from codec.iter_decode(b, end)
+            else:
+                n = 0
+                for record in codec.iter_decode(b, end, passes):
+                    n += 1
+                    yield record
+                stats.count(filename, 'records_filtered',
+                            end // record_length - n)
+            rest = b[end:]
+
+        if rest:
+            stats.reading(filename)
+            stats.count(filename, 'records')
+            stats.count(filename, 'partial_record_bytes', len(rest))
+            if passes is None or passes(rest):
+                yield codec.decode(rest)
+            else:
+                stats.count(filename, 'records_filtered')
 
-    return contents
+def _open(filename, mode):
+    '''
+    Open a file for reading, from memory if ``prefetch`` already read it.
+    Files inside archives are read straight out of the archive.
+    '''
+    b = prefetch.take(filename)
+    if b is None:
+        return archive.open(filename, mode)
+    f = io.BytesIO(b)
+    return f if 'b' in mode else io.TextIOWrapper(f)
 
 def parse_format_string(s):
     '''
@@ -224,6 +385,7 @@ def bytes_to_list(b, format_spec, field_names):
                 val = cur.decode('ASCII').strip()
             except UnicodeDecodeError:
                 val = ''
+                stats.count(None, 'ascii_decode_failures')
                 if DEBUG:
                     print('Decode failed for field "%s". Bytes was %s' % (name,orig_bytes))
 
@@ -249,6 +411,7 @@ def bytes_to_list(b, format_spec, field_names):
                 val = float(cur)
             except ValueError:
                 val = -1
+                stats.count(None, 'bad_floats')
 
         rtn.append((name,val))
 
@@ -264,6 +427,451 @@ def bytes_to_list(b, format_spec, field_names):
 
     return rtn
 
+class RecordCodec:
+    '''
+    A binary record layout, compiled once into a ``struct.Struct`` and a list
+    of per-field post-processors. Decodes records exactly as ``bytes_to_list``
+    does, without re-parsing the format string for every record.
+
+    Parameters
+    ----------
+
+    format_spec : str
+        A Fortran-style data formatting string.
+
+    field_names : list of str
+        A list of names for the fields enumerated in format_spec.
+
+    record_length : int
+        The number of bytes in a record.
+
+    fields : iterable of str
+        If given, only decode these fields; the bytes of the others are
+        skipped. Names that aren't in the record are ignored. Any field can
+        still be decoded on its own with ``decode_field``.
+    '''
+
+    def __init__(self, format_spec, field_names, record_length, fields=None):
+        self.format_spec = format_spec
+        self.field_names = list(field_names)
+        self.record_length = record_length
+        self.fields = None if fields is None else frozenset(fields)
+
+        struct_fmt = ['<']
+        self.names = []
+        self.converters = []
+        self.slices = {}
+        offset = 0
+        for fmt, name in zip(parse_format_string(format_spec), field_names):
+            size = fmt['size']
+            offset += size
+
+            if fmt['type'] == 'X':
+                # skip the junk bytes without allocating anything for them
+                struct_fmt.append('%dx' % size)
+                continue
+
+            # where to find this field on its own, for decoding it lazily
+            self.slices[name] = (offset-size, offset, _converters[fmt['type']])
+
+            if self.fields is not None and name not in self.fields:
+                # not wanted; skip it like the junk
+                struct_fmt.append('%dx' % size)
+                continue
+
+            if fmt['type'] == 'I' and size in _native_ints:
+                struct_fmt.append(_native_ints[size])
+                converter = None
+            else:
+                struct_fmt.append('%ds' % size)
+                converter = _converters[fmt['type']]
+
+            self.names.append(name)
+            self.converters.append(converter)
+
+        if offset > record_length:
+            raise ValueError('Format "%s" is longer than the record length %d'
+                             % (format_spec, record_length))
+
+        # the rest of the record is uninitialized memory; step over it
+        if offset < record_length:
+            struct_fmt.append('%dx' % (record_length - offset))
+
+        self.struct = struct.Struct(''.join(struct_fmt))
+        self._fields = list(zip(self.names, self.converters))
+
+    def _build(self, values):
+        return [(name, val if conv is None else conv(val))
+                for (name, conv), val in zip(self._fields, values)]
+
+    def decode(self, b, offset=0):
+        '''
+        Decode the record starting at ``offset`` in the buffer ``b``.
+        '''
+        if len(b) - offset < self.record_length:
+            # trailing partial record; fall back to the field-by-field parser
+            rtn = bytes_to_list(bytes(b[offset:]), self.format_spec,
+                                self.field_names)
+            if self.fields is not None:
+                rtn = [(k, v) for k, v in rtn if k in self.fields]
+            return rtn
+        return self._build(self.struct.unpack_from(b, offset))
+
+    def decode_field(self, b, name):
+        '''
+        Decode only the field ``name`` from the record buffer ``b``.
+        '''
+        start, end, conv = self.slices[name]
+        return conv(b[start:end])
+
+    def count_failures(self, b, end):
+        '''
+        Count the fields of the whole records in the first ``end`` bytes of
+        the buffer ``b`` that can't be decoded: ``A`` fields that aren't
+        ASCII, and ``F`` fields that aren't numbers. Nothing is decoded
+        otherwise.
+
+        Returns
+        -------
+
+        tuple of int
+            The number of ASCII decode failures and of bad floats.
+        '''
+        checked = sorted((start, stop, conv) for start, stop, conv
+                         in self.slices.values()
+                         if conv in (_decode_ascii, _decode_float))
+        fmt = ['<']
+        offset = 0
+        for start, stop, _ in checked:
+            fmt.append('%dx%ds' % (start - offset, stop - start))
+            offset = stop
+        fmt.append('%dx' % (self.record_length - offset))
+
+        ascii_idx = [i for i, (_, _, conv) in enumerate(checked)
+                     if conv is _decode_ascii]
+        float_idx = [i for i, (_, _, conv) in enumerate(checked)
+                     if conv is _decode_float]
+
+        bad_ascii = bad_floats = 0
+        for values in struct.iter_unpack(''.join(fmt), b[:end]):
+            for i in ascii_idx:
+                if not values[i].isascii():
+                    bad_ascii += 1
+            for i in float_idx:
+                try:
+                    float(values[i])
+                except ValueError:
+                    bad_floats += 1
+        return bad_ascii, bad_floats
+
+    def matcher(self, where):
+        '''
+        Compile a list of ``(field name, test)`` conditions into a function
+        ``passes(b, offset)``, which checks the record at ``offset`` in the
+        buffer ``b`` against them, decoding only the fields being tested.
+        Fields that are cut off by the end of the buffer decode the same way
+        as in ``bytes_to_list``. Returns None if there are no conditions.
+        '''
+        if not where:
+            return None
+        checks = [self.slices[name] + (test,) for name, test in where]
+
+        def passes(b, offset=0):
+            for start, end, conv, test in checks:
+                if not test(conv(b[offset+start:offset+end])):
+                    return False
+            return True
+
+        return passes
+
+    def iter_decode(self, b, end, passes=None):
+        '''
+        Decode the whole records in the first ``end`` bytes of the buffer
+        ``b``, one at a time. ``end`` must be a multiple of the record length.
+        With ``passes`` (from ``matcher``), only the records it accepts are
+        decoded.
+        '''
+        if passes is None:
+            for values in self.struct.iter_unpack(memoryview(b)[:end]):
+                yield self._build(values)
+            return
+
+        view = memoryview(b)
+        unpack = self.struct.unpack_from
+        for offset in range(0, end, self.record_length):
+            if passes(view, offset):
+                yield self._build(unpack(view, offset))
+
+    def decode_all(self, b, where=None):
+        '''
+        Decode every record in the buffer ``b``, including a trailing partial
+        record if there is one. With ``where``, only the records that pass
+        those ``(field name, test)`` conditions are decoded.
+        '''
+        end = len(b) - len(b) % self.record_length
+
+        passes = self.matcher(where)
+        rtn = list(self.iter_decode(b, end, passes))
+
+        if end < len(b) and (passes is None or passes(b, end)):
+            rtn.append(self.decode(b, end))
+
+        return rtn
+
+def _decode_ascii(cur):
+    try:
+        return str(cur, 'ASCII').strip()
+    except UnicodeDecodeError:
+        if DEBUG:
+            print('Decode failed for field. Bytes was %s' % cur)
+        stats.count(None, 'ascii_decode_failures')
+        return ''
+
+def _decode_float(cur):
+    # it turns out their "floating point" format is just an ASCII string
+    # writing the floating point number out.
+    try:
+        return float(bytes(cur))
+    except ValueError:
+        stats.count(None, 'bad_floats')
+        return -1
+
+def _decode_int(cur):
+    # via trial-and-error, it looks like their machines were little-endian
+    return int.from_bytes(cur, 'little')
+
+_converters = {
+    'A' : _decode_ascii,
+    'F' : _decode_float,
+    'I' : _decode_int,
+}
+
+# integer sizes that struct can unpack directly (little-endian, unsigned)
+_native_ints = {1 : 'B', 2 : 'H', 4 : 'I', 8 : 'Q'}
+
+_codecs = {}
+
+def compile_codec(format_spec, field_names, record_length, fields=None):
+    '''
+    Get the ``RecordCodec`` for a record layout (decoding only ``fields``, if
+    given), compiling it on first use.
+    '''
+    if fields is not None:
+        # only the requested fields that are in this record matter
+        fields = tuple(n for n in field_names if n and n in fields)
+    key = (format_spec, tuple(field_names), record_length, fields)
+    if key not in _codecs:
+        _codecs[key] = RecordCodec(format_spec, field_names, record_length,
+                                   fields)
+    return _codecs[key]
+
+def get_codec(file_type, fields=None):
+    '''
+    Get the compiled ``RecordCodec`` for one of the ``binary_types``.
+    '''
+    return compile_codec(**convert_fields(binary_types[file_type]),
+                         fields=fields)
+
+class BuginFile:
+    '''
+    Random-access view of a BUGIN binary file, backed by ``mmap`` (or by
+    its contents, if ``prefetch`` already read it). Supports ``len()``,
+    indexing, slicing and iteration; records are only decoded when they are
+    accessed, and then only the fields that are read.
+
+    Parameters
+    ----------
+
+    filename : str
+        The file path
+
+    codec : RecordCodec
+        The layout of the records in the file.
+    '''
+
+    def __init__(self, filename, codec):
+        self.filename = filename
+        self.codec = codec
+
+        self._mmap = None
+        b = prefetch.take(filename)
+        if b is None and archive.split(filename) is not None:
+            # archive members can't be mapped
+            with archive.open(filename) as f:
+                b = f.read()
+        if b is None:
+            with open(filename, 'rb') as f:
+                try:
+                    self._mmap = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                except ValueError:
+                    # can't map an empty file
+                    b = b''
+
+        self._buf = memoryview(self._mmap if self._mmap is not None else b)
+
+        # a trailing partial record still counts, as in read_binary_file
+        n = -(-len(self._buf) // codec.record_length)
+        self._rows = range(n)
+
+        stats.count(filename, 'bytes', len(self._buf))
+        stats.count(filename, 'partial_record_bytes',
+                    len(self._buf) % codec.record_length)
+
+    def _view(self, rows):
+        rtn = object.__new__(BuginFile)
+        rtn.filename = self.filename
+        rtn.codec = self.codec
+        rtn._mmap = None
+        rtn._buf = self._buf
+        rtn._rows = rows
+        return rtn
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._view(self._rows[idx])
+
+        start = self._rows[idx]*self.codec.record_length
+        return BuginRecord(self._buf[start:start+self.codec.record_length],
+                           self.codec)
+
+    def __iter__(self):
+        rl = self.codec.record_length
+        stats.reading(self.filename)
+        n = 0
+        try:
+            for start in self._rows:
+                yield BuginRecord(self._buf[start*rl:(start+1)*rl], self.codec)
+                n += 1
+        finally:
+            stats.count(self.filename, 'records', n)
+
+    def decoded(self, where=None):
+        '''
+        Iterate over the records, fully decoded, skipping those that fail the
+        ``(field name, test)`` conditions ``where``. Only the fields being
+        tested are decoded for records that are skipped.
+        '''
+        rl = self.codec.record_length
+        passes = self.codec.matcher(where)
+        stats.reading(self.filename)
+        n = kept = 0
+        try:
+            for row in self._rows:
+                n += 1
+                offset = row*rl
+                if passes is None or passes(self._buf, offset):
+                    kept += 1
+                    yield self.codec.decode(self._buf, offset)
+        finally:
+            stats.count(self.filename, 'records', n)
+            stats.count(self.filename, 'records_filtered', n - kept)
+
+    def count_failures(self):
+        '''
+        Count (into ``stats``) the fields of the whole file's complete
+        records that can't be decoded, without decoding anything else; see
+        ``RecordCodec.count_failures``.
+        '''
+        rl = self.codec.record_length
+        end = len(self._buf) - len(self._buf) % rl
+        bad_ascii, bad_floats = self.codec.count_failures(self._buf, end)
+        stats.count(self.filename, 'ascii_decode_failures', bad_ascii)
+        stats.count(self.filename, 'bad_floats', bad_floats)
+        return bad_ascii, bad_floats
+
+    def close(self):
+        self._buf.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # records still hold views into the map; it will be closed
+                # when they are garbage collected
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BuginRecord:
+    '''
+    A single record of a ``BuginFile``. Behaves like the list of field
+    name-value pairs returned by ``bytes_to_list``, but each field is only
+    decoded when it is read.
+    '''
+
+    __slots__ = ('_buf', '_codec')
+
+    def __init__(self, buf, codec):
+        self._buf = buf
+        self._codec = codec
+
+    def __len__(self):
+        return len(self._codec.names)
+
+    def __getitem__(self, idx):
+        name = self._codec.names[idx]
+        return (name, self._codec.decode_field(self._buf, name))
+
+    def __iter__(self):
+        for name in self._codec.names:
+            yield (name, self._codec.decode_field(self._buf, name))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def get(self, name, default=None):
+        '''
+        Decode and return only the field ``name``.
+        '''
+        if name not in self._codec.slices:
+            return default
+        return self._codec.decode_field(self._buf, name)
+
+    def matches(self, where):
+        '''
+        Whether the record passes the ``(field name, test)`` conditions
+        ``where``, decoding only the fields being tested.
+        '''
+        return all(test(self.get(name)) for name, test in where)
+
+    def decode(self):
+        '''
+        Decode the whole record at once, into a list of field name-value
+        pairs.
+        '''
+        return self._codec.decode(self._buf)
+
+def open_bugin(directory, file_type, fields=None):
+    '''
+    Open a BUGIN binary file for random access, without reading it in.
+
+    Parameters
+    ----------
+
+    directory : str
+        The directory to read from
+
+    file_type : str
+        Which file to open. Must be one of the keys of ``binary_types``.
+
+    fields : iterable of str
+        If given, records only have (and only decode) these fields.
+    '''
+
+    if file_type not in binary_types:
+        raise ValueError('Cannot open %s for random access; only binary file '
+                         'types are supported' % file_type)
+
+    return BuginFile(path.join(directory, file_type),
+                     get_codec(file_type, fields))
+
 def convert_fields(d):
     '''
     Convert a list of field name-data format pairs into a Fortran-style format
@@ -282,6 +890,28 @@ def convert_fields(d):
 
     return rtn
 
+def file_fields(file_type):
+    '''
+    The names of the fields of one BUGIN file type.
+    '''
+    if file_type in binary_types:
+        return [k for k, _ in binary_types[file_type]['fields'] if k]
+    if file_type in ascii_types:
+        return list(ascii_types[file_type]['field_names'])
+    if file_type in user_types:
+        # user files hold species records
+        return file_fields('SPECIES')
+    raise ValueError('Unrecognized file type %s' % file_type)
+
+def known_fields():
+    '''
+    The names of all the fields of all the BUGIN file types.
+    '''
+    rtn = set()
+    for ftype in chain(binary_types, ascii_types, user_types):
+        rtn.update(file_fields(ftype))
+    return rtn
+
 ### DEFINITIONS OF FILE FORMATS
 
 binary_types = {
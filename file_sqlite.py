@@ -0,0 +1,159 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Export BUGIN data from many directories into one indexed SQLite database.
+'''
+
+import sqlite3
+from itertools import chain
+from os import path
+
+from archive import listdir, output_dir
+from file_read import read_bugin, convert_fields, parse_format_string
+from file_read import binary_types, ascii_types
+
+# SQL column types for each Fortran field type
+sql_types = {'A' : 'TEXT', 'I' : 'INTEGER', 'F' : 'REAL'}
+
+# each table's source files; SAMPLE2 records are stored alongside the SAMPLES
+# records they go with
+tables = {
+    'samples' : ['SAMPLES', 'SAMPLE2'],
+    'species' : ['SPECIES'],
+    'abundance' : ['ABUNDAN'],
+    'header' : ['HEADER'],
+}
+
+indexes = [
+    ('samples', 'Sample Top'),
+    ('species', 'Species Code'),
+    ('abundance', 'Pointer to SPECIES File'),
+    ('abundance', 'Pointer to SAMPLES File'),
+]
+
+def export_sqlite(dirs, dbfile):
+    '''
+    Load the BUGIN files from each of dirs into the SQLite database dbfile,
+    creating it if necessary. Data already in the database from one of dirs
+    is replaced.
+    '''
+
+    conn = sqlite3.connect(dbfile)
+    try:
+        create_tables(conn)
+        for d in dirs:
+            write_directory(conn, d)
+    finally:
+        conn.close()
+
+def create_tables(conn):
+    '''
+    Create the tables and indexes, if they don't exist yet.
+    '''
+
+    with conn:
+        for table, file_types in tables.items():
+            cols = ['"well" TEXT NOT NULL', '"directory" TEXT NOT NULL']
+            if table != 'header':
+                cols.append('"record" INTEGER NOT NULL')
+            cols += ['%s %s' % (_quote(name), sql_type)
+                     for name, sql_type in _columns(file_types)]
+
+            conn.execute('CREATE TABLE IF NOT EXISTS %s (%s)'
+                         % (table, ', '.join(cols)))
+            conn.execute('CREATE INDEX IF NOT EXISTS %s_well ON %s (well)'
+                         % (table, table))
+            conn.execute('CREATE INDEX IF NOT EXISTS %s_directory ON %s '
+                         '(directory)' % (table, table))
+
+        for table, col in indexes:
+            conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                         % (_quote('%s_%s' % (table, col)), table, _quote(col)))
+
+def write_directory(conn, directory):
+    '''
+    Load the BUGIN files in one directory into the database, in a single
+    transaction.
+
+    Returns
+    -------
+
+    bool
+        Whether any BUGIN files were found.
+    '''
+
+    present = listdir(directory)
+    name = path.basename(output_dir(directory).rstrip('/'))
+
+    if not any(f in present for f in chain(*tables.values())):
+        print('Warning: no BUGIN files found in directory "%s"' % directory)
+        return False
+
+    with conn:
+        for table, file_types in tables.items():
+            conn.execute('DELETE FROM %s WHERE directory = ?' % table,
+                         (directory,))
+
+            if file_types[0] not in present:
+                continue
+
+            rows = _rows(directory, file_types, present)
+            if table != 'header':
+                rows = ((i,) + r for i, r in enumerate(rows))
+
+            ncols = len(_columns(file_types)) + (2 if table == 'header' else 3)
+            conn.executemany('INSERT INTO %s VALUES (%s)'
+                             % (table, ', '.join('?'*ncols)),
+                             ((name, directory) + r for r in rows))
+
+    return True
+
+def _rows(directory, file_types, present):
+    '''
+    Generate the value tuples for a table, joining in SAMPLE2 if needed.
+    '''
+
+    records, _ = read_bugin(directory, file_types[0], stream=True)
+    n = len(_columns(file_types[:1]))
+
+    # pad out short records (e.g. a HEADER file with lines missing)
+    rows = (tuple(v for _, v in r)[:n] + (None,)*(n-len(r)) for r in records)
+
+    if len(file_types) == 1:
+        return rows
+
+    # SAMPLE2's records line up with SAMPLES's, minus SAMPLES's first one
+    n2 = len(_columns(file_types[1:]))
+    if file_types[1] in present:
+        extra, _ = read_bugin(directory, file_types[1], stream=True)
+        extra = chain([(None,)*n2],
+                      (tuple(v for _, v in r) for r in extra))
+    else:
+        extra = iter(())
+
+    return (r + next(extra, (None,)*n2) for r in rows)
+
+def _columns(file_types):
+    '''
+    The column names and SQL types for a list of file types.
+    '''
+
+    rtn = []
+    for ftype in file_types:
+        if ftype in ascii_types:
+            rtn += [(k, 'TEXT') for k in ascii_types[ftype]['field_names']]
+            continue
+
+        d = convert_fields(binary_types[ftype])
+        for fmt, k in zip(parse_format_string(d['format_spec']),
+                          d['field_names']):
+            if fmt['type'] != 'X':
+                rtn.append((k, sql_types[fmt['type']]))
+
+    return rtn
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
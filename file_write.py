@@ -3,13 +3,39 @@ This file is part of BUGOUT
 (c) Greg Meyer, 2018
 '''
 
-from os import listdir, path
-from file_read import read_bugin, convert_fields
-from file_read import binary_types, ascii_types, user_types
+import os
+import shutil
+from os import path
+from itertools import islice
+from archive import listdir, output_dir
+from file_read import read_bugin, open_bugin, convert_fields
+from file_read import binary_types, ascii_types, user_types, file_fields
+from batch import map_directories
+from sinks import open_sink, create, open_output, split_format
+from sinks import output_name, read_header, read_rows, JSONLinesSink
+from dedup import Deduplicator, sidecar
+from journal import Journal, fsync
+from journal import EXTENSION as JOURNAL_EXTENSION
+import cache
+import filters
+import manifest
+import prefetch
+import stats
 
 DEBUG = False
 
-def combine(directory, do_abund=True):
+# number of rows to accumulate before handing them to the file
+WRITE_BATCH = 4096
+
+# the fields ``combine`` reads from each file to join them, whichever columns
+# are output
+JOIN_FIELDS = {
+    'SPECIES' : ['Taxa'],
+    'ABUNDAN' : ['Frequency', 'Pointer to SPECIES File',
+                 'Pointer to SAMPLES File'],
+}
+
+def combine(directory, do_abund=True, format='csv', where=None, fields=None):
     '''
     Read in SAMPLES, SAMPLE2, SPECIES, ABUNDAN, and HEADER, and generate the
     combined output files "clean_abundance.csv" and "clean_samples.csv".
@@ -18,11 +44,28 @@ def combine(directory, do_abund=True):
     ----------
 
     directory : str
-        The directory in which to look for the files.
+        The directory in which to look for the files. May be an archive, or a
+        directory inside one (see ``archive``); the outputs then go in
+        ``archive.output_dir(directory)``.
 
     do_abund : bool
         If set to false, "abundance.csv" will not be created
 
+    format : str
+        The output format; one of the keys of ``sinks.sinks``. Sets the
+        extension of the output files, and may end in ".gz" for compressed
+        output.
+
+    where : dict
+        Only output the samples, species and abundance records that pass
+        these filters (see ``filters``). Abundance records whose sample or
+        species was filtered out are dropped too, before they are decoded.
+
+    fields : iterable of str
+        Only output these columns, in the usual column order. Fields that
+        aren't output aren't decoded either (except the abundance records'
+        pointers, which are needed for the join).
+
     Returns
     -------
 
@@ -45,136 +88,263 @@ def combine(directory, do_abund=True):
               'Skipping...' % directory)
         return False
 
+    # map the binary files rather than decoding them up front, so that
+    # records that are filtered out are never fully decoded
     data = {}
     for fname in required + [f for f in optional if f in present]:
-        data[fname], _ = read_bugin(directory, fname)
+        wanted = fields
+        if fields is not None and fname in JOIN_FIELDS:
+            wanted = set(fields).union(JOIN_FIELDS[fname])
+        if fname in binary_types:
+            data[fname] = open_bugin(directory, fname, wanted)
+        else:
+            data[fname], _ = read_bugin(directory, fname, fields=wanted)
+
+    try:
+        return _write_combined(directory, data, do_abund, format, where or {},
+                               fields)
+    finally:
+        for d in data.values():
+            if hasattr(d, 'close'):
+                d.close()
+
+def clean_fields(abundance=True):
+    '''
+    The columns that the outputs of ``combine`` can have: those of
+    "clean_samples", and with ``abundance``, of "clean_abundance" too.
+    '''
+    rtn = ['Name', 'Source directory']
+    if abundance:
+        rtn += ['Frequency', 'Taxa']
+    for ftype in ['SAMPLES', 'SAMPLE2', 'HEADER']:
+        rtn += file_fields(ftype)
+    return rtn
+
+def _write_combined(directory, data, do_abund, format, where, fields):
+    '''
+    Write the combined output files for ``combine``, given the data read
+    from ``directory``, with only the columns ``fields`` (or all of them).
+    An output that would have none of the columns isn't written, so an
+    earlier full one is left alone.
+    '''
 
     file_fields = ['Name', 'Source directory']
     abund_fields = ['Frequency']
     species_fields = ['Taxa']
-    sample_fields = [k for k,_ in data['SAMPLES'][0]]
+    sample_fields = list(data['SAMPLES'].codec.names)
     header_fields = [k for k,_ in data['HEADER'][0]]
     if 'SAMPLE2' in data:
-        sample2_fields = [k for k,_ in data['SAMPLE2'][0]]
+        sample2_fields = list(data['SAMPLE2'].codec.names)
     else:
-        fields = convert_fields(binary_types['SAMPLE2'])['field_names']
-        sample2_fields = [field for field in fields if field != '']
+        names = convert_fields(binary_types['SAMPLE2'])['field_names']
+        sample2_fields = [field for field in names if field != '']
+
+    if fields is not None:
+        wanted = set(fields)
+        file_fields, abund_fields, species_fields, sample2_fields = (
+            [k for k in group if k in wanted]
+            for group in (file_fields, abund_fields, species_fields,
+                          sample2_fields))
+
+    out = output_dir(directory, create=True)
 
     file_data = {
         'Source directory' : directory,
-        'Name' : directory.rstrip('/').split('/')[-1]
+        'Name' : path.basename(out.rstrip('/'))
     }
 
-    if do_abund:
-        with open(path.join(directory, 'clean_abundance.csv'), 'w') as f:
-
-            # write out header
-            f.write(','.join(file_fields + abund_fields + species_fields +\
-                             sample_fields + sample2_fields + header_fields))
-            f.write('\n')
-
-            for n,d in enumerate(data['ABUNDAN'][1:]):
-                vals = []
-
-                vals += [file_data[k] for k in file_fields]
-
+    timer = stats.timer(directory)
+    timer.switch('read')
+
+    # decode the lookup tables once; ABUNDAN is decoded as it's read
+    records = {k : _decode_table(v, where.get(k, ()))
+               for k, v in data.items() if k in binary_types and k != 'ABUNDAN'}
+    for k in where:
+        if k in records:
+            stats.count(path.join(directory, k), 'records_filtered',
+                        records[k].count(None))
+
+    if 'SAMPLE2' in records:
+        stats.count(path.join(directory, 'SAMPLE2'), 'sample2_misalignment',
+                    abs(len(records['SAMPLE2']) - (len(records['SAMPLES'])-1)))
+
+    abund_file = path.join(directory, 'ABUNDAN')
+
+    # build each lookup table once, as tuples of values in output column
+    # order, so that each row is just a concatenation
+    timer.switch('join')
+    file_vals = _values(file_data, file_fields)
+    header_vals = _values(dict(data['HEADER'][0]), header_fields)
+    samples, sample2_vals = _sample_table(records, sample_fields,
+                                          sample2_fields)
+
+    abund_columns = file_fields + abund_fields + species_fields + \
+                    sample_fields + sample2_fields + header_fields
+    sample_columns = file_fields + sample_fields + sample2_fields + \
+                     header_fields
+
+    if do_abund and abund_columns:
+        species = _join_table(records['SPECIES'], species_fields)
+        no_species = ('',)*len(species_fields)
+        no_sample = ('',)*len(sample_fields)
+        sample_index = sample_fields.index('Sample Index') \
+                       if 'Sample Index' in sample_fields else None
+
+        # drop abundance records for filtered-out samples and species before
+        # decoding them
+        abund_where = list(where.get('ABUNDAN', ()))
+        if 'SAMPLES' in where:
+            abund_where.append(('Pointer to SAMPLES File', _kept(samples)))
+        if 'SPECIES' in where:
+            abund_where.append(('Pointer to SPECIES File', _kept(species)))
+
+        timer.switch('write')
+        with open_sink(path.join(out, 'clean_abundance'), abund_columns,
+                       format) as sink:
+
+            timer.switch('join')
+            rows = []
+            # the first record isn't data
+            for n,d in enumerate(data['ABUNDAN'][1:].decoded(abund_where)):
                 abund = dict(d)
-                vals += [abund[k] for k in abund_fields]
 
                 spec_idx = abund['Pointer to SPECIES File']
                 try:
-                    spec = dict(data['SPECIES'][spec_idx])
+                    spec = species[spec_idx]
                 except IndexError:
                     if DEBUG:
                         print('Index %d out of bounds for SPECIES file.' % spec_idx)
-                    spec = {k : '' for k in species_fields}
+                    stats.count(abund_file, 'species_pointers_out_of_range')
+                    spec = no_species
 
-                vals += [spec[k] for k in species_fields]
-
-                # TODO: can use a better data structure for speed, if we decide we need it
                 sample_idx = abund['Pointer to SAMPLES File']
                 try:
-                    sample = dict(data['SAMPLES'][sample_idx])
+                    sample = samples[sample_idx]
                 except IndexError:
                     if DEBUG:
                         print('Index %d out of bounds for SAMPLES file.' % sample_idx)
-                    sample = {k : '' for k in sample_fields}
-
-                sample2_idx = abund['Pointer to SAMPLES File']-1
-                if 'SAMPLE2' in data:
-                    if sample2_idx < len(data['SAMPLE2']):
-                        sample.update(dict(data['SAMPLE2'][sample2_idx]))
-                    else:
-                        # TODO: I think SAMPLE2 is aligned somehow with SAMPLES
-                        # in a way I don't know
-                        # print('Index %d out of bounds for SAMPLE2 file.' % sample2_idx)
-                        for k in sample2_fields:
-                            sample[k] = '--'
-                else:
-                    for k in sample2_fields:
-                        sample[k] = ''
+                    stats.count(abund_file, 'samples_pointers_out_of_range')
+                    sample = no_sample + sample2_vals(sample_idx)
 
                 # make sure we actually read the right one
-                if sample['Sample Index'] != abund['Pointer to SAMPLES File'] and DEBUG:
+                if DEBUG and sample_index is not None and \
+                   sample[sample_index] != sample_idx:
                     print('Sample index incorrect')
 
-                vals += [sample[k] for k in sample_fields + sample2_fields]
+                vals = file_vals + _values(abund, abund_fields) + spec + sample
 
                 # write out the header stuff on the first row
                 if n == 0:
-                    header = dict(data['HEADER'][0])
-                    vals += [header[k] for k in header_fields]
+                    vals += header_vals
 
-                str_vals = [str(v) for v in vals]
-                str_vals = [v.join('""') if ',' in v else v for v in str_vals]
+                rows.append(vals)
+                if len(rows) >= WRITE_BATCH:
+                    timer.switch('write')
+                    sink.write_rows(rows)
+                    rows.clear()
+                    timer.switch('join')
 
-                f.write(','.join(str_vals))
-                f.write('\n')
+            timer.switch('write')
+            sink.write_rows(rows)
 
     # write filled-out samples file
-    with open(path.join(directory, 'clean_samples.csv'), 'w') as f:
+    timer.switch('write')
+    if sample_columns:
+        with open_sink(path.join(out, 'clean_samples'), sample_columns,
+                       format) as sink:
+            for i in range(1, len(samples), WRITE_BATCH):
+                sink.write_rows(file_vals + sample + header_vals
+                                for sample in samples[i:i+WRITE_BATCH]
+                                if sample is not None)
+
+    timer.stop()
+    return True
 
-        # write out header
-        f.write(','.join(file_fields + sample_fields + sample2_fields + header_fields))
-        f.write('\n')
+def _decode_table(f, where):
+    '''
+    Decode every record of the ``BuginFile`` f into a dictionary, or None if
+    it doesn't pass the filters ``where`` (so that pointers into the file
+    still line up). The result is cached until the file changes, if the
+    filters are ones from ``filters``.
+    '''
+    def load():
+        return [dict(r.decode()) if r.matches(where) else None for r in f]
 
-        for n,d in enumerate(data['SAMPLES'][1:]):
-            vals = []
+    where_key = filters.cache_key(where)
+    if where_key is None:
+        return load()
+    return cache.cached(f.filename, ('table', where_key, f.codec.fields),
+                        load)
 
-            vals += [file_data[k] for k in file_fields]
+def _values(record, fields):
+    '''
+    The values of ``fields`` from a dictionary ``record``, as a tuple.
+    '''
+    return tuple(record[k] for k in fields)
+
+def _join_table(records, fields):
+    '''
+    Turn the decoded records of a BUGIN file into a list of value tuples (one
+    per record) holding ``fields``. Records that were filtered out (None)
+    stay None.
+    '''
+    return [None if r is None else _values(r, fields) for r in records]
+
+def _kept(table):
+    '''
+    A test for whether a pointer refers to a record of ``table`` that
+    wasn't filtered out.
+    '''
+    def kept(idx):
+        return 0 <= idx < len(table) and table[idx] is not None
+    return kept
 
-            sample = dict(d)
+def _sample_table(records, sample_fields, sample2_fields):
+    '''
+    Build the lookup table of SAMPLES records joined with their SAMPLE2
+    records, indexed by position in the SAMPLES file.
 
-            if 'SAMPLE2' in data and len(data['SAMPLE2']) > n:
-                d2 = data['SAMPLE2'][n]
-                sample.update(dict(d2))
-            else:
-                if 'SAMPLE2' not in data:
-                    s = ''
-                else:
-                    s = '--'
+    Returns
+    -------
 
-                for k in sample2_fields:
-                    sample[k] = s
+    list of tuple
+        The values of ``sample_fields + sample2_fields`` for each sample.
 
-            vals += [sample[k] for k in sample_fields + sample2_fields]
+    function
+        Maps a SAMPLES index to the values of ``sample2_fields`` only, for
+        pointers that are past the end of the SAMPLES file.
+    '''
 
-            # write out the header stuff
-            header = dict(data['HEADER'][0])
-            vals += [header[k] for k in header_fields]
+    samples = _join_table(records['SAMPLES'], sample_fields)
 
-            str_vals = [str(v).replace('"','') for v in vals]
-            str_vals = [v.join('""') if ',' in v else v for v in str_vals]
+    if 'SAMPLE2' in records:
+        sample2 = _join_table(records['SAMPLE2'], sample2_fields)
+        missing = ('--',)*len(sample2_fields)
+    else:
+        sample2 = []
+        missing = ('',)*len(sample2_fields)
 
-            f.write(','.join(str_vals))
-            f.write('\n')
+    def sample2_vals(idx):
+        # SAMPLE2 records line up with SAMPLES, minus SAMPLES's first record
+        # TODO: I think SAMPLE2 is aligned somehow with SAMPLES
+        # in a way I don't know
+        if sample2 and idx-1 < len(sample2):
+            return sample2[idx-1]
+        return missing
 
-    return True
+    return [None if s is None else s + sample2_vals(i)
+            for i, s in enumerate(samples)], sample2_vals
 
-def parse_and_write(directory):
+def parse_and_write(directory, format='csv', where=None, fields=None):
     '''
     Parse all bugin files in the directory, and write them in CSV
-    format to the same.
+    format (or another of ``sinks.sinks``) to the same (or, for a directory
+    in an archive, to ``archive.output_dir(directory)``).
+
+    Filters in ``where`` (see ``filters``) are applied to each file on its
+    own; without the join, abundance records aren't filtered by their sample
+    or species. With ``fields``, only those columns of each file are decoded
+    and written, and files with none of them are left alone.
     '''
 
     file_types = list(binary_types) + \
@@ -189,58 +359,234 @@ def parse_and_write(directory):
         print('Warning: no BUGIN files found in directory "%s"' % directory)
         return
 
+    out = output_dir(directory, create=True)
+    timer = stats.timer(directory)
+
     for ftype in valid_files:
 
+        if fields is not None and not set(fields) & set(file_fields(ftype)):
+            # nothing to write; don't clobber an earlier full output
+            continue
+
         if DEBUG:
             print('Processing file %s' % path.join(directory, ftype))
 
-        data, extra_data = read_bugin(directory, ftype)
-
-        with open(path.join(directory,ftype+'.csv'), 'w') as f:
-
-            if len(data) == 0:
-                continue
+        timer.switch('read')
+        data, extra_data = read_bugin(directory, ftype, stream=True,
+                                      where=(where or {}).get(ftype),
+                                      fields=fields)
+        first = next(data, None)
+
+        timer.switch('write')
+        if not first:
+            # an empty file; write an empty output
+            open_sink(path.join(out, ftype), [], format).close()
+            continue
+
+        with open_sink(path.join(out, ftype), [k for k,_ in first],
+                       format) as sink:
+            sink.write_rows([[v for _,v in first]])
+            while True:
+                rows = [[v for _,v in d] for d in islice(data, WRITE_BATCH)]
+                if not rows:
+                    break
+                sink.write_rows(rows)
+
+    timer.stop()
+    return
 
-            f.write(','.join(k for k,_ in data[0]))
-            f.write('\n')
+def gen_master_samples(dirs, outfname, jobs=1, force=False, content_hash=False,
+                       format='csv', read_ahead=0, budget=prefetch.BUDGET,
+                       where=None, fields=None, keep_duplicates=False,
+                       resume=False):
+    '''
+    Generate a master samples CSV combining the sample lists in all of dirs,
+    and write it to outfname (plus ".gz", if ``format`` is compressed; see
+    ``sinks.output_name``).
+
+    Directories whose "clean_samples.csv" is missing or older than their
+    BUGIN files (or all of them, if ``force`` is set) are combined first,
+    using ``jobs`` processes. See ``manifest.is_current`` for
+    ``content_hash``. With a ``format`` other than "csv", the per-directory
+    sample files and the master file are in that format instead.
+
+    With ``read_ahead`` set (and ``jobs`` of 1), the inputs of that many
+    directories are read ahead on background threads, using at most
+    ``budget`` bytes; see ``prefetch.ahead``.
+
+    Only samples that pass the filters ``where`` are included, and only the
+    columns ``fields``, if given.
+
+    Directories whose BUGIN files are copies of an earlier directory's are
+    left out, and listed in a duplicates file next to outfname (see
+    ``dedup``), unless ``keep_duplicates`` is set.
+
+    Progress is recorded in a journal next to outfname (see ``journal``),
+    which is deleted when the master file is complete. With ``resume``, a
+    run that was interrupted carries on from its journal: directories it
+    already combined aren't combined again (even with ``force``), and the
+    master file is added to from the last directory it finished merging.
+    '''
 
-            for d in data:
-                # write out the data string, making sure that we put quotes around
-                # commas!
-                # TODO: use csv.writer
-                s = ''
-                for _,v in d:
-                    ss = str(v).replace('"','')
-                    if ',' in ss:
-                        ss = '"%s"' % ss
-                    s += ss + ','
-                f.write(s)
-                f.write('\n')
+    outfname = output_name(outfname, format)
+
+    if not keep_duplicates:
+        dedup = Deduplicator(manifest.TARGETS['clean_samples'][0])
+        dirs = list(dedup.unique(dirs))
+        dedup.write(sidecar(outfname, format), format)
+
+    jrnl = Journal(outfname + JOURNAL_EXTENSION, resume)
+    done = jrnl.done()
+
+    stale = [d for d in dirs if d not in done and
+             (force or not manifest.is_current(d, 'clean_samples', content_hash,
+                                               format, where, fields))]
+    if read_ahead and jobs <= 1:
+        stale = prefetch.ahead(stale, manifest.TARGETS['clean_samples'][0],
+                               read_ahead, budget)
+    failed = set()
+    for d, success in map_directories(manifest.build, stale, jobs,
+                                      convert=combine,
+                                      target='clean_samples',
+                                      force=True,
+                                      content_hash=content_hash,
+                                      do_abund=False,
+                                      format=format,
+                                      where=where,
+                                      fields=fields):
+        if success:
+            jrnl.record(directory=d)
+        else:
+            failed.add(d)
+
+    merge_files([path.join(output_dir(d), 'clean_samples.'+format)
+                 for d in dirs if d not in failed], outfname, format,
+                journal=jrnl)
+    jrnl.finish()
+
+def merge_files(fnames, outfname, format='csv', chunk_rows=WRITE_BATCH,
+                journal=None):
+    '''
+    Concatenate files written by a sink into outfname, under the union of
+    their header columns (in order of first appearance). Files with different
+    columns are reordered and padded with empty values to match. Rows are
+    streamed in chunks of ``chunk_rows``, so memory use doesn't grow with the
+    inputs. JSON Lines files, which carry their field names in every row, are
+    simply concatenated.
+
+    With a ``journal`` (see ``journal.Journal``), the files are added to
+    outfname one at a time, and each is recorded in the journal with the
+    size of outfname after it. If the journal shows an interrupted merge
+    with the same columns, outfname is cut back to the size recorded after
+    the last file that was finished, and only the files after it are added.
+    '''
 
-    return
+    jsonl = split_format(format)[0] is JSONLinesSink
+    headers = [[] if jsonl else read_header(fname, format)
+               for fname in fnames]
+
+    columns = []
+    seen = set()
+    for h in headers:
+        for k in h:
+            if k not in seen:
+                seen.add(k)
+                columns.append(k)
+
+    if journal is None:
+        if jsonl:
+            with open(outfname + '.tmp', 'wb') as fout:
+                for fname in fnames:
+                    _copy_bytes(fname, fout)
+            os.replace(outfname + '.tmp', outfname)
+            return
+
+        with create(outfname, columns, format) as sink:
+            for fname, header in zip(fnames, headers):
+                _append_rows(fname, header, sink, columns, format, chunk_rows)
+        return
 
-def gen_master_samples(dirs, outfname):
+    done = _resume_merge(journal, outfname, columns, format)
+    if done is None:
+        # start over; writes just the header
+        create(outfname, columns, format).close()
+        fsync(outfname)
+        journal.record(columns=columns, format=format,
+                       offset=path.getsize(outfname))
+        done = set()
+
+    for fname, header in zip(fnames, headers):
+        if fname in done:
+            continue
+        if jsonl:
+            with open(outfname, 'ab') as fout:
+                _copy_bytes(fname, fout)
+        else:
+            with create(outfname, columns, format, append=True) as sink:
+                _append_rows(fname, header, sink, columns, format,
+                             chunk_rows)
+        fsync(outfname)
+        journal.record(file=fname, offset=path.getsize(outfname))
+
+def _resume_merge(journal, outfname, columns, format):
     '''
-    Generate a master samples CSV combining the sample lists in all of dirs,
-    and write it to outfname.
+    If the journal shows an interrupted merge into outfname with these
+    columns, cut outfname back to where the last finished file ended, and
+    return the files that were finished. Otherwise None, including when a
+    directory was converted again since the merge began, since the file
+    already merged from it is out of date.
     '''
 
-    with open(outfname, 'w') as fout:
+    starts = [i for i, e in enumerate(journal.entries) if 'columns' in e]
+    if not starts:
+        return None
 
-        first = True
-        for d in dirs:
-            if not path.isfile(path.join(d,'clean_samples.csv')):
-                # need to generate it
-                success = combine(d, do_abund=False)
+    merge = journal.entries[starts[-1]:]
+    if merge[0]['columns'] != columns or merge[0]['format'] != format:
+        return None
+    if any('offset' not in e for e in merge):
+        return None
 
-                if not success:
-                    continue
+    offset = merge[-1]['offset']
+    if not path.isfile(outfname) or path.getsize(outfname) < offset:
+        return None
 
-            with open(path.join(d,'clean_samples.csv')) as fin:
-                # skip the headers on all but the first one
-                if not first:
-                    fin.readline()
-                else:
-                    first = False
+    # drop anything written after the last file that was finished
+    with open(outfname, 'r+b') as f:
+        f.truncate(offset)
+    return {e['file'] for e in merge[1:]}
+
+def _copy_bytes(fname, fout):
+    '''
+    Copy the file fname onto the end of the open file fout. For JSON Lines,
+    this works for gzip too, since concatenated gzip files decompress to the
+    concatenation of their contents.
+    '''
+    with open(fname, 'rb') as fin:
+        shutil.copyfileobj(fin, fout)
+
+def _append_rows(fname, header, sink, columns, format, chunk_rows):
+    '''
+    Copy the rows of the file fname, with columns ``header``, into sink,
+    under ``columns``.
+    '''
 
-                fout.write(fin.read())
+    with open_output(fname, format) as fin:
+        # skip the header
+        fin.readline()
+
+        if header == columns:
+            # nothing to rearrange; copy the text straight over
+            shutil.copyfileobj(fin, sink.f)
+            return
+
+        idx = [header.index(k) if k in header else None
+               for k in columns]
+        rows = (tuple('' if i is None or i >= len(r) else r[i]
+                      for i in idx)
+                for r in read_rows(fin, format))
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            sink.write_rows(chunk)
@@ -0,0 +1,138 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Select which records to convert. Filters are given as a dictionary mapping a
+BUGIN file type to a list of ``(field name, test)`` pairs; a record is only
+decoded (and joined, and written) if each test passes on its field's value.
+The tests are checked on the raw record before the rest of it is decoded.
+
+The tests are classes rather than lambdas so that they can be sent to worker
+processes.
+'''
+
+# the value of "Marker or Rework Flag" for reworked specimens
+REWORK_FLAG = 'R'
+
+class Between:
+    '''
+    Whether a number is between lo and hi (inclusive). Either may be None, for
+    no bound on that side.
+    '''
+
+    def __init__(self, lo=None, hi=None):
+        self.lo = lo
+        self.hi = hi
+
+    def __call__(self, value):
+        return (self.lo is None or value >= self.lo) and \
+               (self.hi is None or value <= self.hi)
+
+    def __repr__(self):
+        return 'Between(%r, %r)' % (self.lo, self.hi)
+
+class OneOf:
+    '''
+    Whether a value is one of ``values``.
+    '''
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+
+    def __call__(self, value):
+        return value in self.values
+
+    def __repr__(self):
+        return 'OneOf(%r)' % sorted(self.values)
+
+class NotEqual:
+    '''
+    Whether a value is anything but ``value`` (ignoring case).
+    '''
+
+    def __init__(self, value):
+        self.value = value.upper()
+
+    def __call__(self, value):
+        return value.upper() != self.value
+
+    def __repr__(self):
+        return 'NotEqual(%r)' % self.value
+
+# the tests whose reprs describe them completely
+TESTS = (Between, OneOf, NotEqual)
+
+def make(depth=None, species=None, no_rework=False):
+    '''
+    Build the filters for the common selections.
+
+    Parameters
+    ----------
+
+    depth : tuple of float
+        Only keep samples whose top is in this ``(lo, hi)`` window. Either
+        end may be None.
+
+    species : iterable of str
+        Only keep these species codes.
+
+    no_rework : bool
+        Drop abundance records flagged as reworked.
+
+    Returns
+    -------
+
+    dict
+        The filters, or None if there aren't any.
+    '''
+
+    where = {}
+    if depth is not None:
+        where['SAMPLES'] = [('Sample Top', Between(*depth))]
+    if species is not None:
+        where['SPECIES'] = [('Species Code', OneOf(species))]
+    if no_rework:
+        where['ABUNDAN'] = [('Marker or Rework Flag', NotEqual(REWORK_FLAG))]
+    return where or None
+
+def parse_depth(s):
+    '''
+    Parse a depth window "LO:HI" (either may be left out) for ``make``.
+    '''
+    lo, sep, hi = s.partition(':')
+    if not sep:
+        raise ValueError('depth window must be given as LO:HI')
+    return (float(lo) if lo.strip() else None,
+            float(hi) if hi.strip() else None)
+
+def parse_list(s):
+    '''
+    Parse a comma-separated list, e.g. of species codes.
+    '''
+    return [v.strip() for v in s.split(',') if v.strip()]
+
+def cache_key(tests):
+    '''
+    A key for a list of ``(field name, test)`` pairs, for caching the records
+    they select. None if any test isn't one of ``TESTS``: other callables
+    can't be told apart by their reprs, which may even be reused by a
+    different function after the first is garbage collected.
+    '''
+    if not tests:
+        return ()
+    if not all(type(test) in TESTS for _, test in tests):
+        return None
+    return tuple((field, repr(test)) for field, test in tests)
+
+def describe(where):
+    '''
+    A canonical string for a set of filters, to tell outputs made with
+    different filters apart.
+    '''
+    if not where:
+        return ''
+    return ';'.join('%s.%s:%r' % (ftype, field, test)
+                    for ftype in sorted(where)
+                    for field, test in where[ftype])
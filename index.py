@@ -0,0 +1,228 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+An inverted index of which species occur where, across many wells. Each
+species (by code and taxa) maps to its postings: the well, sample, sample
+depth and frequency of every abundance record that points at it. The index
+is a SQLite file whose postings are stored clustered by species, so a lookup
+reads only that species' postings and never touches the BUGIN files:
+
+    update_index(dirs, 'species.idx')
+    for row in query('species.idx', ['G. ruber']):
+        ...
+
+Directories are only read again when their SAMPLES, SPECIES or ABUNDAN
+files have changed since they were indexed.
+'''
+
+import json
+import sqlite3
+from os import path
+
+from archive import listdir, output_dir
+from file_read import open_bugin
+from batch import map_directories
+import manifest
+import stats
+
+# the files each directory's postings are built from
+INPUTS = ['SAMPLES', 'SPECIES', 'ABUNDAN']
+
+# the columns of a query result
+COLUMNS = ['Species Code', 'Taxa', 'Name', 'Source directory', 'Sample',
+           'Sample Top', 'Frequency']
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS wells (
+           id INTEGER PRIMARY KEY,
+           directory TEXT NOT NULL UNIQUE,
+           name TEXT NOT NULL,
+           fingerprint TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS taxa (
+           id INTEGER PRIMARY KEY,
+           code TEXT NOT NULL,
+           taxa TEXT NOT NULL,
+           UNIQUE (code, taxa))''',
+    'CREATE INDEX IF NOT EXISTS taxa_taxa ON taxa (taxa COLLATE NOCASE)',
+    # "record" is the abundance record's position in ABUNDAN, which keeps
+    # the key unique when a sample lists a species more than once
+    '''CREATE TABLE IF NOT EXISTS postings (
+           taxon INTEGER NOT NULL,
+           well INTEGER NOT NULL,
+           record INTEGER NOT NULL,
+           sample INTEGER NOT NULL,
+           depth REAL,
+           frequency TEXT,
+           PRIMARY KEY (taxon, well, record)) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS postings_well ON postings (well)',
+]
+
+def update_index(dirs, dbfile, jobs=1, force=False):
+    '''
+    Add the species in each of dirs to the index in dbfile, creating it if
+    necessary. Directories that are already indexed are only read again if
+    their BUGIN files have changed (or ``force`` is set); ``jobs`` processes
+    are used to read them.
+
+    Returns
+    -------
+
+    int
+        The number of directories that were (re)indexed.
+    '''
+
+    conn = sqlite3.connect(dbfile)
+    try:
+        with conn:
+            for sql in SCHEMA:
+                conn.execute(sql)
+
+        indexed = dict(conn.execute('SELECT directory, fingerprint '
+                                    'FROM wells'))
+
+        def stale(d):
+            return force or indexed.get(d) != _fingerprint(d)
+
+        n = 0
+        for d, result in map_directories(postings, (d for d in dirs
+                                                    if stale(d)), jobs):
+            if result is not None:
+                _write(conn, d, *result)
+                n += 1
+        return n
+    finally:
+        conn.close()
+
+def postings(directory):
+    '''
+    Read the postings of one directory, for ``update_index``.
+
+    Returns
+    -------
+
+    tuple
+        The fingerprint of the inputs, taken before reading them, and a
+        list of ``(species code, taxa, record, sample, depth, frequency)``
+        tuples. None if the directory is missing any of ``INPUTS``.
+    '''
+
+    present = listdir(directory)
+    if not all(f in present for f in INPUTS):
+        print('Warning: Could not find necessary files in directory "%s". '
+              'Skipping...' % directory)
+        return None
+
+    fp = _fingerprint(directory)
+
+    with open_bugin(directory, 'SPECIES', ['Species Code', 'Taxa']) as f:
+        species = [tuple(v for _, v in r.decode()) for r in f]
+    with open_bugin(directory, 'SAMPLES', ['Sample Top']) as f:
+        depths = [r.decode()[0][1] for r in f]
+
+    abund_file = path.join(directory, 'ABUNDAN')
+    rows = []
+    with open_bugin(directory, 'ABUNDAN',
+                    ['Frequency', 'Pointer to SPECIES File',
+                     'Pointer to SAMPLES File']) as f:
+        # the first record isn't data
+        for n, d in enumerate(f[1:].decoded(), 1):
+            abund = dict(d)
+
+            spec_idx = abund['Pointer to SPECIES File']
+            if not 0 <= spec_idx < len(species):
+                # nothing to index it under
+                stats.count(abund_file, 'species_pointers_out_of_range')
+                continue
+
+            sample_idx = abund['Pointer to SAMPLES File']
+            if 0 <= sample_idx < len(depths):
+                depth = depths[sample_idx]
+            else:
+                stats.count(abund_file, 'samples_pointers_out_of_range')
+                depth = None
+
+            rows.append(species[spec_idx] +
+                        (n, sample_idx, depth, abund['Frequency']))
+
+    return fp, rows
+
+def query(dbfile, terms):
+    '''
+    Look up species in the index in dbfile.
+
+    Parameters
+    ----------
+
+    dbfile : str
+        The index file.
+
+    terms : list of str
+        Species codes or taxa names to look for. Taxa are matched without
+        regard to case, and may contain SQL ``LIKE`` wildcards (``%`` and
+        ``_``).
+
+    Returns
+    -------
+
+    list of tuple
+        The postings of the matching species, with the values of
+        ``COLUMNS``, ordered by species, well and depth.
+    '''
+
+    if not path.isfile(dbfile):
+        raise FileNotFoundError('No index at "%s"' % dbfile)
+
+    conn = sqlite3.connect(dbfile)
+    try:
+        match = ' OR '.join(['taxa.code = ? OR taxa.taxa LIKE ?']*len(terms))
+        args = [t for term in terms for t in (term, term)]
+        return conn.execute(
+            'SELECT taxa.code, taxa.taxa, wells.name, wells.directory, '
+            '       postings.sample, postings.depth, postings.frequency '
+            'FROM taxa '
+            'JOIN postings ON postings.taxon = taxa.id '
+            'JOIN wells ON wells.id = postings.well '
+            'WHERE %s '
+            'ORDER BY taxa.code, taxa.taxa, wells.name, wells.directory, '
+            '         postings.depth, postings.record' % (match or '0'),
+            args).fetchall()
+    finally:
+        conn.close()
+
+def _fingerprint(directory):
+    return json.dumps(manifest.fingerprint(directory, INPUTS), sort_keys=True)
+
+def _write(conn, directory, fp, rows):
+    '''
+    Replace a directory's postings in the index, in a single transaction.
+    '''
+
+    name = path.basename(output_dir(directory).rstrip('/'))
+    with conn:
+        row = conn.execute('SELECT id FROM wells WHERE directory = ?',
+                           (directory,)).fetchone()
+        if row is None:
+            well = conn.execute('INSERT INTO wells (directory, name, '
+                                'fingerprint) VALUES (?, ?, ?)',
+                                (directory, name, fp)).lastrowid
+        else:
+            well = row[0]
+            conn.execute('UPDATE wells SET name = ?, fingerprint = ? '
+                         'WHERE id = ?', (name, fp, well))
+            conn.execute('DELETE FROM postings WHERE well = ?', (well,))
+
+        # only look up this directory's taxa, through their UNIQUE index,
+        # rather than reading the whole table for every directory
+        ids = {}
+        for pair in set(r[:2] for r in rows):
+            conn.execute('INSERT OR IGNORE INTO taxa (code, taxa) '
+                         'VALUES (?, ?)', pair)
+            ids[pair] = conn.execute('SELECT id FROM taxa '
+                                     'WHERE code = ? AND taxa = ?',
+                                     pair).fetchone()[0]
+
+        conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)',
+                         ((ids[r[:2]], well) + r[2:] for r in rows))
@@ -0,0 +1,133 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Record the progress of a long run, so that it can pick up where it left off
+if it's interrupted:
+
+    j = Journal('run.journal', resume=True)
+    for d in dirs:
+        if d not in j.done():
+            convert(d)
+            j.record(directory=d)
+    j.finish()
+
+The journal is a file of one JSON object per line. Each entry is on disk
+before ``record`` returns, so after a crash the journal holds everything
+that was finished, plus perhaps one torn last line, which is dropped.
+Nothing is written until the first entry is recorded, so a run with nothing
+to do leaves no journal behind.
+'''
+
+import json
+import hashlib
+import os
+from os import path
+
+# the extension added to an output file's name for its journal
+EXTENSION = '.journal'
+
+# the journal for conversions that don't have an output file of their own to
+# go next to, in the current directory, by run (see ``run_id``)
+RUN_NAME = 'bugout_%s' + EXTENSION
+
+class Journal:
+    '''
+    An append-only log of completed work.
+
+    Parameters
+    ----------
+
+    filename : str
+        The journal file.
+
+    resume : bool
+        Carry on from the entries already in the journal. Otherwise, it is
+        started afresh.
+    '''
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.entries = load(filename) if resume else []
+        self.f = None
+
+    def done(self):
+        '''
+        The directories recorded as done.
+        '''
+        return {e['directory'] for e in self.entries if 'directory' in e}
+
+    def record(self, **entry):
+        '''
+        Add an entry, and wait for it to be written to disk.
+        '''
+        if self.f is None:
+            self._open()
+        self.f.write(json.dumps(entry) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.entries.append(entry)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def finish(self):
+        '''
+        Close the journal and delete it, since the run is complete.
+        '''
+        self.close()
+        if path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def _open(self):
+        # rewrite the entries that survived, so that new ones aren't
+        # appended to a torn line
+        with open(self.filename + '.tmp', 'w') as f:
+            f.writelines(json.dumps(e) + '\n' for e in self.entries)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.filename + '.tmp', self.filename)
+
+        self.f = open(self.filename, 'a')
+
+def run_id(target, inputs):
+    '''
+    A name for a run that converts the directories described by ``inputs``
+    (a JSON-encodable description of the directories and how they're
+    converted) to ``target``, for the files it keeps in the current
+    directory. Runs with different inputs get different names.
+    '''
+    h = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode())
+    return '%s_%s' % (target, h.hexdigest()[:12])
+
+def load(filename):
+    '''
+    The entries of a journal, up to the first one that isn't whole. Empty if
+    there is no journal.
+    '''
+    rtn = []
+    if not path.isfile(filename):
+        return rtn
+    with open(filename) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                rtn.append(json.loads(line))
+            except ValueError:
+                break
+    return rtn
+
+def fsync(filename):
+    '''
+    Wait for filename's contents to be written to disk.
+    '''
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
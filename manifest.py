@@ -0,0 +1,210 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Keep track of which BUGIN inputs each directory's outputs were built from, so
+that unchanged directories don't have to be converted again.
+'''
+
+import json
+import hashlib
+from os import path, replace
+
+import archive
+from archive import stat, listdir
+from file_read import binary_types, ascii_types, user_types
+import filters
+
+MANIFEST_NAME = '.bugout_manifest.json'
+
+# the inputs each kind of output is built from, and the files it produces,
+# without their extensions (None means one output per input file, as from
+# parse_and_write)
+TARGETS = {
+    'clean' : (['SAMPLES', 'SAMPLE2', 'SPECIES', 'ABUNDAN', 'HEADER'],
+               ['clean_abundance', 'clean_samples']),
+    'clean_samples' : (['SAMPLES', 'SAMPLE2', 'HEADER'],
+                       ['clean_samples']),
+    'raw' : (sorted(list(binary_types) + list(ascii_types) + list(user_types)),
+             None),
+}
+
+# building one target also brings these others up to date
+IMPLIES = {
+    'clean' : ['clean_samples'],
+}
+
+def key(target, format='csv', where=None, fields=None):
+    '''
+    The manifest entry for ``target`` built in output format ``format``, with
+    the filters ``where`` and only the columns ``fields``.
+    '''
+    rtn = target if format == 'csv' else '%s:%s' % (target, format)
+    query = []
+    if where:
+        query.append(filters.describe(where))
+    if fields is not None:
+        query.append('columns=' + ','.join(fields))
+    if query:
+        rtn += '?' + '&'.join(query)
+    return rtn
+
+def fingerprint(directory, names, content_hash=False):
+    '''
+    Record the size and modification time (and optionally a hash of the
+    contents) of each of the files ``names`` that is present in ``directory``.
+    '''
+
+    rtn = {}
+    for name in names:
+        fname = path.join(directory, name)
+        try:
+            st = stat(fname)
+        except FileNotFoundError:
+            continue
+
+        rtn[name] = {'size' : st.st_size, 'mtime_ns' : st.st_mtime_ns}
+        if content_hash:
+            rtn[name]['sha1'] = file_hash(fname)
+
+    return rtn
+
+def file_hash(fname, chunk_size=1<<20):
+    '''
+    SHA-1 of a file's contents, read in chunks of ``chunk_size`` bytes.
+    '''
+    h = hashlib.sha1()
+    with archive.open(fname) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load(directory):
+    '''
+    Read a directory's manifest, or an empty one if it doesn't have one.
+    '''
+    try:
+        with open(path.join(archive.output_dir(directory),
+                            MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save(directory, manifest):
+    '''
+    Write a directory's manifest, atomically. For a directory in an
+    archive, it goes with the outputs (see ``archive.output_dir``).
+    '''
+    fname = path.join(archive.output_dir(directory, create=True),
+                      MANIFEST_NAME)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    replace(fname + '.tmp', fname)
+
+def outputs(directory, target, format='csv'):
+    '''
+    The output files that building ``target`` in format ``format`` produces
+    for ``directory`` (in ``archive.output_dir(directory)``).
+    '''
+    inputs, outs = TARGETS[target]
+    if outs is None:
+        present = listdir(directory)
+        outs = [f for f in inputs if f in present]
+    return [f+'.'+format for f in outs]
+
+def is_current(directory, target, content_hash=False, format='csv',
+               where=None, fields=None):
+    '''
+    Whether the outputs for ``target`` (in format ``format``, with filters
+    ``where`` and columns ``fields``) exist and were built from the BUGIN
+    files currently in ``directory``.
+
+    Files whose modification time changed but whose size didn't are compared
+    by content hash, if ``content_hash`` is set and a hash was recorded. When
+    the contents match, the new modification time is saved in the manifest,
+    so the file isn't hashed again next time.
+    '''
+
+    manifest = load(directory)
+    recorded = manifest.get(key(target, format, where, fields))
+    if recorded is None:
+        return False
+
+    out = archive.output_dir(directory)
+    if not all(path.isfile(path.join(out, f))
+               for f in outputs(directory, target, format)):
+        return False
+
+    current = fingerprint(directory, TARGETS[target][0])
+    if set(current) != set(recorded):
+        return False
+
+    # name -> (new mtime, hash) of the files that were touched but not changed
+    touched = {}
+    for name, info in current.items():
+        old = recorded[name]
+        if info['size'] != old['size']:
+            return False
+        if info['mtime_ns'] == old['mtime_ns']:
+            continue
+        if not (content_hash and 'sha1' in old):
+            return False
+        if file_hash(path.join(directory, name)) != old['sha1']:
+            return False
+        touched[name] = (info['mtime_ns'], old['sha1'])
+
+    if touched:
+        # every entry recorded with the same contents is still current
+        for entry in manifest.values():
+            for name, (mtime_ns, sha1) in touched.items():
+                if name in entry and entry[name].get('sha1') == sha1:
+                    entry[name]['mtime_ns'] = mtime_ns
+        save(directory, manifest)
+
+    return True
+
+def build(directory, convert, target, force=False, content_hash=False,
+          **kwargs):
+    '''
+    Call ``convert(directory, **kwargs)`` to build ``target``, unless the
+    directory's inputs are unchanged since it was last built. Outputs in
+    different formats, with different filters or with different columns (the
+    ``format``, ``where`` and ``fields`` keyword arguments, if ``convert``
+    takes them) are tracked separately.
+
+    Returns
+    -------
+
+    The return value of ``convert``, or True if the build was skipped.
+    '''
+
+    format = kwargs.get('format', 'csv')
+    where = kwargs.get('where')
+    fields = kwargs.get('fields')
+    if not force and is_current(directory, target, content_hash, format,
+                                where, fields):
+        return True
+
+    # fingerprint before building, so that changes made while we're working
+    # will be picked up next time
+    fp = {key(t, format, where, fields) : fingerprint(directory,
+                                                      TARGETS[t][0],
+                                                      content_hash)
+          for t in [target] + IMPLIES.get(target, [])}
+
+    result = convert(directory, **kwargs)
+
+    if result is not False:
+        manifest = load(directory)
+        # builds with other filters or columns wrote to the same files, so
+        # they're no longer current
+        for k in fp:
+            base = k.partition('?')[0]
+            for old in [m for m in manifest if m.partition('?')[0] == base]:
+                del manifest[old]
+        manifest.update(fp)
+        save(directory, manifest)
+
+    return result
@@ -0,0 +1,342 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Pivot abundance data into a samples x species matrix, across many wells.
+The matrix is sparse: it is built straight from ABUNDAN's pointers, one entry
+per abundance record, so building it takes time proportional to the number
+of abundance records rather than samples x species. Columns are species
+codes, shared between wells.
+
+    m = build_matrix(dirs)
+    write_matrix(m, 'abundance.mtx')  # or 'abundance.csv', for a dense table
+
+Sparse output is in Matrix Market format, with the labels of its rows and
+columns in ".rows.csv" and ".columns.csv" files alongside it.
+'''
+
+import gzip
+from array import array
+from os import path
+
+from archive import listdir, output_dir
+from file_read import open_bugin
+from file_write import WRITE_BATCH
+from batch import map_directories
+from sinks import create, output_name
+import stats
+
+# the files a directory's part of the matrix is built from
+INPUTS = ['SAMPLES', 'SPECIES', 'ABUNDAN']
+
+# the columns labelling each row (sample)
+ROW_FIELDS = ['Name', 'Source directory', 'Sample Index', 'Sample Top',
+              'Sample Bottom']
+
+# the columns labelling each column (species)
+COLUMN_FIELDS = ['Species Code', 'Taxa']
+
+MTX_EXTENSIONS = ('.mtx', '.mtx.gz')
+
+class Matrix:
+    '''
+    A sparse samples x species matrix of abundance frequencies, held as
+    coordinates (row, column, value), one per abundance record. Values are
+    the frequencies as recorded, which are usually counts but may be codes
+    like "R" (rare).
+    '''
+
+    def __init__(self):
+        # the ROW_FIELDS values of each row
+        self.rows = []
+        # species code -> taxa, in order of first appearance
+        self.species = {}
+        self._columns = {}
+
+        self.row_idx = array('l')
+        self.col_idx = array('l')
+        self.values = []
+
+    def add(self, part):
+        '''
+        Add one directory's samples and abundances, as returned by
+        ``read_directory``.
+        '''
+        rows, species, entries = part
+
+        base = len(self.rows)
+        self.rows.extend(rows)
+
+        cols = []
+        for code, taxa in species:
+            if code not in self._columns:
+                self._columns[code] = len(self._columns)
+                self.species[code] = taxa
+            cols.append(self._columns[code])
+
+        rs, ss, vs = entries
+        self.row_idx.extend(base + r for r in rs)
+        self.col_idx.extend(cols[s] for s in ss)
+        self.values.extend(vs)
+
+    @property
+    def shape(self):
+        return len(self.rows), len(self.species)
+
+    def __len__(self):
+        '''
+        The number of entries.
+        '''
+        return len(self.values)
+
+    def codes(self):
+        '''
+        The species code of each column, in column order (sorted).
+        '''
+        return sorted(self.species)
+
+    def csr(self):
+        '''
+        The matrix in compressed sparse row form, with columns ordered as in
+        ``codes()``. Entries for the same sample and species are added
+        together if they are numbers; otherwise the last one is kept.
+
+        Returns
+        -------
+
+        indptr : list of int
+            The entries of row i are ``indptr[i]:indptr[i+1]``.
+
+        indices : list of int
+            The column of each entry.
+
+        values : list of str
+            The value of each entry.
+        '''
+
+        # renumber the columns into sorted order
+        rank = {code : i for i, code in enumerate(self.codes())}
+        col = [0]*len(self._columns)
+        for code, i in self._columns.items():
+            col[i] = rank[code]
+
+        # counting sort by row
+        nrows = len(self.rows)
+        start = [0]*(nrows+1)
+        for r in self.row_idx:
+            start[r+1] += 1
+        for i in range(nrows):
+            start[i+1] += start[i]
+
+        pos = start[:-1]
+        order = [0]*len(self.values)
+        for n, r in enumerate(self.row_idx):
+            order[pos[r]] = n
+            pos[r] += 1
+
+        indptr = [0]
+        indices = []
+        values = []
+        for i in range(nrows):
+            row = {}
+            for n in order[start[i]:start[i+1]]:
+                c = col[self.col_idx[n]]
+                row[c] = _add(row[c], self.values[n]) if c in row \
+                         else self.values[n]
+            for c in sorted(row):
+                indices.append(c)
+                values.append(row[c])
+            indptr.append(len(indices))
+
+        return indptr, indices, values
+
+def read_directory(directory, where=None):
+    '''
+    Read one directory's part of the matrix, for ``Matrix.add``.
+
+    Parameters
+    ----------
+
+    directory : str
+        The directory to read from.
+
+    where : dict
+        Only include the samples, species and abundance records that pass
+        these filters (see ``filters``).
+
+    Returns
+    -------
+
+    tuple
+        The ``ROW_FIELDS`` of each sample, the ``(code, taxa)`` of each
+        species, and the abundance entries as lists of sample row, species
+        position and frequency. None if the directory is missing any of
+        ``INPUTS``.
+    '''
+
+    present = listdir(directory)
+    if not all(f in present for f in INPUTS):
+        print('Warning: Could not find necessary files in directory "%s". '
+              'Skipping...' % directory)
+        return None
+
+    where = where or {}
+    name = path.basename(output_dir(directory).rstrip('/'))
+
+    # row of each SAMPLES record, or None. The first record isn't data
+    rows = []
+    row_of = [None]
+    with open_bugin(directory, 'SAMPLES', ROW_FIELDS) as f:
+        for r in f[1:]:
+            if r.matches(where.get('SAMPLES', ())):
+                d = dict(r.decode())
+                row_of.append(len(rows))
+                rows.append((name, directory) +
+                            tuple(d[k] for k in ROW_FIELDS[2:]))
+            else:
+                row_of.append(None)
+
+    # column of each SPECIES record, or None. The first record isn't data
+    species = []
+    species_of = [None]
+    with open_bugin(directory, 'SPECIES', COLUMN_FIELDS) as f:
+        for r in f[1:]:
+            if r.matches(where.get('SPECIES', ())):
+                species_of.append(len(species))
+                species.append(tuple(v for _, v in r.decode()))
+            else:
+                species_of.append(None)
+
+    abund_file = path.join(directory, 'ABUNDAN')
+    rs, ss, vs = [], [], []
+    with open_bugin(directory, 'ABUNDAN',
+                    ['Frequency', 'Pointer to SPECIES File',
+                     'Pointer to SAMPLES File']) as f:
+        for d in f[1:].decoded(where.get('ABUNDAN')):
+            abund = dict(d)
+
+            spec_idx = abund['Pointer to SPECIES File']
+            if 0 < spec_idx < len(species_of):
+                s = species_of[spec_idx]
+            else:
+                stats.count(abund_file, 'species_pointers_out_of_range')
+                continue
+
+            sample_idx = abund['Pointer to SAMPLES File']
+            if 0 < sample_idx < len(row_of):
+                r = row_of[sample_idx]
+            else:
+                stats.count(abund_file, 'samples_pointers_out_of_range')
+                continue
+
+            # the sample or species was filtered out
+            if r is None or s is None:
+                continue
+
+            rs.append(r)
+            ss.append(s)
+            vs.append(abund['Frequency'])
+
+    return rows, species, (rs, ss, vs)
+
+def build_matrix(dirs, jobs=1, where=None):
+    '''
+    Build the abundance matrix for all of dirs, reading them with ``jobs``
+    processes. Only the records that pass the filters ``where`` (see
+    ``filters``) are included.
+    '''
+    m = Matrix()
+    for _, part in map_directories(read_directory, dirs, jobs, where=where):
+        if part is not None:
+            m.add(part)
+    return m
+
+def write_matrix(m, filename, format='csv'):
+    '''
+    Write the matrix m to ``sinks.output_name(filename, format)``. If that
+    ends in ".mtx" (or ".mtx.gz"), the matrix is written in sparse Matrix
+    Market format, and its row and column labels in CSVs beside it. Otherwise
+    it is written as a dense table in ``format`` (see ``sinks``), with one
+    row per sample, one column per species code, and empty cells where a
+    species wasn't recorded. A dense table is compressed if its name ends in
+    ".gz".
+    '''
+
+    filename = output_name(filename, format)
+    if filename.endswith(MTX_EXTENSIONS):
+        _write_mtx(m, filename)
+    else:
+        _write_dense(m, filename, format)
+
+def _write_mtx(m, filename):
+    '''
+    Write the Matrix Market file, which can only hold numbers; entries that
+    aren't are left out, with a warning.
+    '''
+
+    indptr, indices, values = m.csr()
+
+    entries = []
+    skipped = []
+    for i in range(len(indptr)-1):
+        for n in range(indptr[i], indptr[i+1]):
+            try:
+                v = float(values[n])
+            except ValueError:
+                skipped.append(values[n])
+                continue
+            entries.append('%d %d %.15g\n' % (i+1, indices[n]+1, v))
+
+    base = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+    base = base[:-len('.mtx')]
+
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wt') as f:
+        f.write('%%MatrixMarket matrix coordinate real general\n')
+        f.write('%% rows: %s, columns: %s\n'
+                % (path.basename(base + '.rows.csv'),
+                   path.basename(base + '.columns.csv')))
+        f.write('%d %d %d\n' % (m.shape + (len(entries),)))
+        f.writelines(entries)
+
+    with create(base + '.rows.csv', ROW_FIELDS) as sink:
+        sink.write_rows(m.rows)
+    with create(base + '.columns.csv', COLUMN_FIELDS) as sink:
+        sink.write_rows((code, m.species[code]) for code in m.codes())
+
+    if skipped:
+        print('Warning: %d entries with frequencies that are not numbers '
+              '(e.g. "%s") were left out of "%s".'
+              % (len(skipped), skipped[0], filename))
+
+def _write_dense(m, filename, format):
+    # compressed according to the name, as for Matrix Market files
+    format = format[:-len('.gz')] if format.endswith('.gz') else format
+    if filename.endswith('.gz'):
+        format += '.gz'
+
+    indptr, indices, values = m.csr()
+    codes = m.codes()
+    with create(filename, ROW_FIELDS + codes, format) as sink:
+        empty = ['']*len(codes)
+        batch = []
+        for i, row in enumerate(m.rows):
+            vals = list(empty)
+            for n in range(indptr[i], indptr[i+1]):
+                vals[indices[n]] = values[n]
+            batch.append(row + tuple(vals))
+            if len(batch) >= WRITE_BATCH:
+                sink.write_rows(batch)
+                batch.clear()
+        sink.write_rows(batch)
+
+def _add(a, b):
+    '''
+    Add two frequencies, if they're numbers; otherwise take the second.
+    '''
+    try:
+        return '%.15g' % (float(a) + float(b))
+    except ValueError:
+        return b
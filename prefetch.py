@@ -0,0 +1,177 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Read BUGIN files ahead of time on background threads, so that on slow
+storage (e.g. NFS) the next directories are fetched while the current one is
+being converted:
+
+    for d in prefetch.ahead(dirs, ['SAMPLES', 'HEADER'], depth=2):
+        combine(d)
+
+The readers in ``file_read`` pick up prefetched contents automatically.
+'''
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+import archive
+
+# how many directories to read ahead of the one being converted
+DEPTH = 2
+
+# the most bytes of prefetched files to hold in memory at once
+BUDGET = 256<<20
+
+# reads are I/O-bound, so a few threads help on network filesystems
+THREADS = 4
+
+# filename -> (future for the contents, size) for files read ahead
+_store = {}
+_lock = threading.Lock()
+
+def take(filename):
+    '''
+    The contents of filename, if it was prefetched, waiting for the read to
+    finish if necessary; otherwise None. Each prefetched file can only be
+    taken once.
+
+    Contents are only returned if the file's size and modification time are
+    the same as they were before it was read, so that a file that changed
+    since is read again, and the caller's fingerprint of it (see
+    ``manifest.build``) describes what was actually converted.
+    '''
+    if not _store:
+        return None
+
+    with _lock:
+        entry = _store.pop(filename, None)
+    if entry is None:
+        return None
+
+    try:
+        before, b = entry[0].result()
+        now = archive.stat(filename)
+    except OSError:
+        # let the normal read report the problem
+        return None
+
+    if (now.st_size, now.st_mtime_ns) != before:
+        return None
+    return b
+
+def ahead(dirs, names, depth=DEPTH, budget=BUDGET, needed=None,
+          threads=THREADS):
+    '''
+    Yield each of dirs, while reading the files ``names`` in the ``depth``
+    directories after it on background threads.
+
+    Parameters
+    ----------
+
+    dirs : iterable of str
+        The directories, in the order they will be converted. May be a
+        generator.
+
+    names : list of str
+        The files to read from each directory, if present.
+
+    depth : int
+        How many directories ahead of the current one to read.
+
+    budget : int
+        The most bytes to hold in prefetched files that haven't been used yet.
+        Reading ahead pauses when it would go over; a directory that doesn't
+        fit at all is just read normally when its turn comes.
+
+    needed : function
+        If given, only directories for which ``needed(directory)`` is true
+        are read ahead (e.g. those that aren't already up to date).
+
+    threads : int
+        The number of files to read at once.
+    '''
+
+    dirs = iter(dirs)
+    queue = deque()
+    exhausted = False
+
+    pool = ThreadPoolExecutor(max_workers=threads)
+    try:
+        while True:
+            while not exhausted and len(queue) <= depth:
+                d = next(dirs, None)
+                if d is None:
+                    exhausted = True
+                else:
+                    queue.append(_Directory(d, names, needed))
+
+            if not queue:
+                return
+
+            # start reading, in order, as many directories as fit
+            used = sum(q.size for q in queue if q.started)
+            for q in queue:
+                if q.started:
+                    continue
+                if used + q.size > budget:
+                    break
+                q.start(pool)
+                used += q.size
+
+            current = queue.popleft()
+            try:
+                yield current.directory
+            finally:
+                # forget anything the conversion didn't use
+                current.drop()
+
+    finally:
+        for q in queue:
+            q.drop()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+class _Directory:
+    '''
+    The files to read ahead for one directory.
+    '''
+
+    def __init__(self, directory, names, needed):
+        self.directory = directory
+        self.started = False
+        self.files = []
+        if needed is not None and not needed(directory):
+            return
+        for name in names:
+            fname = path.join(directory, name)
+            try:
+                self.files.append((fname, archive.getsize(fname)))
+            except OSError:
+                continue
+
+    @property
+    def size(self):
+        return sum(size for _, size in self.files)
+
+    def start(self, pool):
+        with _lock:
+            for fname, size in self.files:
+                _store[fname] = (pool.submit(_read, fname), size)
+        self.started = True
+
+    def drop(self):
+        with _lock:
+            for fname, _ in self.files:
+                entry = _store.pop(fname, None)
+                if entry is not None:
+                    entry[0].cancel()
+        self.files = []
+
+def _read(filename):
+    st = archive.stat(filename)
+    with archive.open(filename) as f:
+        return (st.st_size, st.st_mtime_ns), f.read()
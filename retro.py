@@ -5,26 +5,27 @@ This file is part of BUGOUT
 
 from sys import stdout
 from time import sleep
-from os.path import isdir
-from os import listdir, system, get_terminal_size
+from os import system, get_terminal_size
+from archive import isdir, listdir
 from string import ascii_letters, digits, punctuation
 valid_chars = ascii_letters + digits + punctuation
 
 from file_write import combine, parse_and_write
-from file_read import read_bugin, binary_types, user_types, ascii_types
+from file_read import read_bugin, open_bugin
+from file_read import binary_types, user_types, ascii_types
 
 DEBUG = True
 
-def retro():
+def retro(turbo=False):
     '''
-    Find some illusion of joy in a fallen world
+    Find some illusion of joy in a fallen world (quickly, with ``turbo``)
     '''
 
-    printer = SlowPagePrinter()
+    printer = SlowPagePrinter(turbo=turbo)
 
     # clear the terminal
-    system('clear')
-    sleep(5)
+    printer.clear()
+    printer.pause(5)
 
     printer.print('''
     WELCOME TO BUGOUT V 0.0.1
@@ -33,7 +34,7 @@ def retro():
 
     ''')
 
-    sleep(1)
+    printer.pause(1)
 
     printer.print('''PLEASE INPUT DIRECTORY NAME: ''')
     directory = input().strip()
@@ -75,46 +76,196 @@ def retro():
         except ValueError:
             choice = -1
 
-    sleep(1)
+    printer.pause(1)
 
     file_type = valid_files[choice]
 
-    result, extra_data = read_bugin(directory, file_type)
+    # records are only read as they are shown, so don't decode the whole file
+    if file_type in binary_types:
+        result = open_bugin(directory, file_type)
+    else:
+        result, extra_data = read_bugin(directory, file_type)
 
-    for n,r in enumerate(result):
-        printer.print('''\n\nRECORD %d/%d\n''' % (n+1,len(result)))
-        maxlen = max(len(k) for k,_ in r)
-        data_printed = False
-        for k,v in r:
-            if not v:
-                continue
-            printer.print(('    %-'+str(maxlen+1)+'s: %s\n') % (k.upper(), str(v)))
-            data_printed = True
-        if not data_printed:
-            printer.print('     <NO DATA FOUND>')
+    browse(printer, result, file_type)
 
     printer.print('\n\n')
 
     printer.print('THANK YOU FOR USING BUGOUT. GOODBYE.\n\n')
 
+def browse(printer, records, name):
+    '''
+    Page through records a screen at a time, reading only the ones shown.
+    Between pages, the user can go forward or back, jump to a record, search
+    for a value, or toggle turbo mode.
+    '''
+
+    if not len(records):
+        printer.print('''\n%s CONTAINS NO RECORDS.\n''' % name)
+        return
+
+    start = 0
+    history = []  # the starts of the pages before this one
+    status = ''
+    while True:
+        end = show_page(printer, records, name, start, status)
+        status = ''
+
+        try:
+            cmd = printer.input('[N]EXT [P]REV [G]OTO # [/]SEARCH [T]URBO '
+                                '[Q]UIT: ').strip()
+        except EOFError:
+            return
+        op = cmd[:1].upper()
+
+        if op in ('', 'N'):
+            if end >= len(records):
+                status = 'END OF FILE.'
+            else:
+                history.append(start)
+                start = end
+
+        elif op == 'P':
+            if history:
+                start = history.pop()
+            else:
+                status = 'START OF FILE.'
+
+        elif op == 'G' or op.isdigit():
+            try:
+                n = int(cmd[1:] if op == 'G' else cmd)
+            except ValueError:
+                status = 'GOTO NEEDS A RECORD NUMBER.'
+                continue
+            history.append(start)
+            start = min(max(n, 1), len(records)) - 1
+
+        elif op == '/':
+            printer.print('SEARCHING...')
+            found = find(records, cmd[1:], start+1)
+            if found is None:
+                status = '"%s" NOT FOUND.' % cmd[1:].strip()
+            else:
+                history.append(start)
+                start = found
+
+        elif op == 'T':
+            printer.turbo = not printer.turbo
+            status = 'TURBO %s.' % ('ENGAGED' if printer.turbo else 'OFF')
+
+        elif op == 'Q':
+            return
+
+        else:
+            status = 'UNKNOWN COMMAND "%s".' % cmd
+
+def show_page(printer, records, name, start, status=''):
+    '''
+    Clear the screen and show as many records from ``start`` as fit on it.
+    Returns the index of the first record that didn't fit.
+    '''
+
+    ncol, nrow = get_terminal_size()
+    # leave room for the title, the status line and the prompt
+    room = max(nrow - 4, 1)
+
+    printer.clear()
+    printer.print('%s: RECORDS %d-' % (name, start+1))
+    lines = []
+    end = start
+    while end < len(records):
+        rec = record_lines(records[end], end, len(records))
+        if lines and len(lines) + len(rec) > room:
+            break
+        lines += rec
+        end += 1
+        if len(lines) >= room:
+            break
+
+    printer.print('%d OF %d\n' % (end, len(records)))
+    printer.print('\n'.join(lines[:room]) + '\n')
+    printer.print(status + '\n')
+    return end
+
+def record_lines(record, n, total):
+    '''
+    The lines of text that show one record.
+    '''
+
+    rtn = ['', 'RECORD %d/%d' % (n+1, total)]
+    maxlen = max([len(k) for k,_ in record] + [0])
+    for k,v in record:
+        if not v:
+            continue
+        rtn.append(('    %-'+str(maxlen+1)+'s: %s') % (k.upper(), str(v)))
+    if len(rtn) == 2:
+        rtn.append('     <NO DATA FOUND>')
+    return rtn
+
+def find(records, query, start=0):
+    '''
+    The index of the first record from ``start`` with a value containing
+    ``query`` (ignoring case), or None. A query of the form "FIELD=VALUE"
+    only looks at that field.
+    '''
+
+    field, sep, value = query.partition('=')
+    if not sep:
+        field, value = '', query
+    field = field.strip().upper()
+    value = value.strip().upper()
+
+    if field and field not in (k.upper() for k, _ in records[0]):
+        return None
+
+    for i in range(start, len(records)):
+        r = records[i]
+        if field:
+            vals = [v for k, v in r if k.upper() == field]
+        else:
+            vals = [v for _, v in r]
+        if any(value in str(v).upper() for v in vals):
+            return i
+    return None
 
 class SlowPagePrinter:
     '''
-    Feel even more like you're playing Fallout
+    Feel even more like you're playing Fallout. With ``turbo`` set, text is
+    printed all at once instead of one character at a time.
     '''
 
-    def __init__(self, delay=0.015):
+    def __init__(self, delay=0.015, turbo=False):
         self.delay = delay
+        self.turbo = turbo
         self.row = 0
         self.col = 0
 
+    def clear(self):
+        system('clear')
+        self.row = 0
+        self.col = 0
+
+    def pause(self, seconds):
+        if not self.turbo:
+            sleep(seconds)
+
+    def input(self, prompt):
+        self.print(prompt)
+        rtn = input()
+        self.row += 1
+        self.col = 0
+        return rtn
+
     def print(self, string):
         ncol, nrow = get_terminal_size()
+        out = []
         for c in string:
             if c == '\n':
                 self.row += 1
 
                 if self.row >= nrow:
+                    if out:
+                        self._write(''.join(out))
+                        out = []
                     system('clear')
                     self.row = 1
 
@@ -123,9 +274,19 @@ class SlowPagePrinter:
             if self.col >= ncol:
                 continue
 
-            print(c, end='')
-            stdout.flush()
-            if c in valid_chars:
+            if self.turbo or c not in valid_chars:
+                out.append(c)
+            else:
+                out.append(c)
+                self._write(''.join(out))
+                out = []
                 sleep(self.delay)
 
             self.col += 1
+
+        if out:
+            self._write(''.join(out))
+
+    def _write(self, s):
+        stdout.write(s)
+        stdout.flush()
@@ -0,0 +1,222 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Output formats. Every writer in BUGOUT goes through a sink, which takes rows
+of values in batches and buffers its writes.
+
+A format is one of the keys of ``sinks``, optionally followed by ".gz" for
+gzip-compressed output (e.g. "csv.gz").
+
+Sinks write to a temporary file, which only replaces the output file when
+the sink is closed, so an interrupted run never leaves a half-written file
+behind. Sinks opened with ``append`` add to the end of an existing file
+instead (in a new gzip member, if compressed).
+'''
+
+import csv
+import gzip
+import io
+import json
+import os
+
+# bytes of output to buffer before writing to disk
+BUFFER_SIZE = 1<<20
+
+# gzip level for compressed outputs; the higher levels are much slower for
+# little gain on CSV
+COMPRESS_LEVEL = 6
+
+class Sink:
+    '''
+    Write rows of values to a file, under a header of field names.
+
+    Parameters
+    ----------
+
+    filename : str
+        The file to write.
+
+    fields : list of str
+        The names of the columns.
+
+    compress : bool
+        Whether to gzip the output.
+
+    append : bool
+        Add rows to the end of filename, without a header, rather than
+        replacing it.
+    '''
+
+    extension = None
+
+    def __init__(self, filename, fields, compress=False, append=False):
+        self.filename = filename
+        self.fields = list(fields)
+        self.append = append
+        self.tmpname = filename if append else filename + '.tmp'
+        mode = 'a' if append else 'w'
+        self.raw = None
+        if compress:
+            # the gzip header records the final name (less ".gz"), not the
+            # temporary one, for "gunzip -N"
+            self.raw = open(self.tmpname, mode+'b')
+            gz = gzip.GzipFile(filename, mode+'b',
+                               compresslevel=COMPRESS_LEVEL, fileobj=self.raw)
+            self.f = io.TextIOWrapper(io.BufferedWriter(gz, BUFFER_SIZE),
+                                      newline='')
+        else:
+            self.f = open(self.tmpname, mode, newline='',
+                          buffering=BUFFER_SIZE)
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def write_rows(self, rows):
+        '''
+        Write a batch of rows, each a sequence of values in the same order as
+        the fields. Rows may be shorter than the header.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Finish writing, and put the output in place.
+        '''
+        self._close()
+        if not self.append:
+            os.replace(self.tmpname, self.filename)
+
+    def abort(self):
+        '''
+        Stop writing, leaving the output file as it was (unless appending).
+        '''
+        self._close()
+        if not self.append:
+            os.remove(self.tmpname)
+
+    def _close(self):
+        self.f.close()
+        # GzipFile doesn't close a file object it was given
+        if self.raw is not None:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class CSVSink(Sink):
+    '''
+    Comma-separated values, quoted as needed.
+    '''
+
+    extension = 'csv'
+    delimiter = ','
+
+    def __init__(self, filename, fields, compress=False, append=False):
+        self.writer = None
+        super().__init__(filename, fields, compress, append)
+
+    def write_header(self):
+        self.writer = csv.writer(self.f, delimiter=self.delimiter,
+                                 lineterminator='\n')
+        if self.fields and not self.append:
+            self.writer.writerow(self.fields)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+class TSVSink(CSVSink):
+    '''
+    Tab-separated values, quoted as needed.
+    '''
+
+    extension = 'tsv'
+    delimiter = '\t'
+
+class JSONLinesSink(Sink):
+    '''
+    One JSON object per line, mapping field names to values.
+    '''
+
+    extension = 'jsonl'
+
+    def write_rows(self, rows):
+        fields = self.fields
+        self.f.writelines(json.dumps(dict(zip(fields, r))) + '\n' for r in rows)
+
+sinks = {s.extension : s for s in [CSVSink, TSVSink, JSONLinesSink]}
+
+def split_format(format):
+    '''
+    The sink class for ``format``, and whether the output is compressed.
+    '''
+    compress = format.endswith('.gz')
+    if compress:
+        format = format[:-len('.gz')]
+    try:
+        return sinks[format], compress
+    except KeyError:
+        raise ValueError('Unknown output format %s' % format)
+
+def create(filename, fields, format='csv', append=False):
+    '''
+    Open a sink for the output format ``format``, writing (or, with
+    ``append``, adding rows) to filename.
+    '''
+    sink, compress = split_format(format)
+    return sink(filename, fields, compress, append)
+
+def output_name(filename, format='csv'):
+    '''
+    The name to write an output file given as filename under: with ".gz"
+    added if ``format`` is compressed and filename doesn't already end in it.
+    '''
+    if split_format(format)[1] and not filename.endswith('.gz'):
+        filename += '.gz'
+    return filename
+
+def open_sink(basename, fields, format='csv'):
+    '''
+    Open a sink for the output format ``format``, writing to ``basename``
+    plus the format's extension.
+    '''
+    return create(basename + '.' + format, fields, format)
+
+def open_output(filename, format='csv'):
+    '''
+    Open a file written by a sink, for reading as text.
+    '''
+    if split_format(format)[1]:
+        return gzip.open(filename, 'rt', newline='')
+    return open(filename, newline='')
+
+def read_header(filename, format='csv'):
+    '''
+    Read the field names from a file written by a sink. JSON Lines files have
+    no header; their fields are the keys of the first row.
+    '''
+    sink, _ = split_format(format)
+    with open_output(filename, format) as f:
+        if sink is JSONLinesSink:
+            line = f.readline()
+            return list(json.loads(line)) if line.strip() else []
+        return next(csv.reader(f, delimiter=sink.delimiter), [])
+
+def read_rows(f, format='csv'):
+    '''
+    Iterate over the rows of an open file written by a sink, after its header,
+    as lists of values (or dicts, for JSON Lines).
+    '''
+    sink, _ = split_format(format)
+    if sink is JSONLinesSink:
+        return (json.loads(line) for line in f if line.strip())
+    return csv.reader(f, delimiter=sink.delimiter)
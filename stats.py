@@ -0,0 +1,225 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Collect timing, throughput and data-quality counters while BUGOUT works.
+
+Nothing is recorded unless a collector is active:
+
+    with stats.collect() as s:
+        combine(directory)
+    s.print_summary()
+'''
+
+import time
+from os import path
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# the collector currently recording, if any
+_active = None
+
+# counters, in the order they are shown in the summary
+COUNTERS = [
+    'bytes',
+    'records',
+    'records_filtered',
+    'partial_record_bytes',
+    'ascii_decode_failures',
+    'bad_floats',
+    'species_pointers_out_of_range',
+    'samples_pointers_out_of_range',
+    'sample2_misalignment',
+]
+
+STAGES = ['read', 'join', 'write']
+
+class Stats:
+    '''
+    Counters for each file, and stage times and peak memory use for each
+    directory.
+    '''
+
+    def __init__(self):
+        self.files = {}
+        self.directories = {}
+        self._file = None
+
+    def count(self, filename, key, n=1):
+        if filename is None:
+            filename = self._file
+        if filename not in self.files:
+            self.files[filename] = Counter()
+        self.files[filename][key] += n
+
+    def _directory(self, directory):
+        if directory not in self.directories:
+            self.directories[directory] = {'seconds' : 0.0,
+                                           'stages' : Counter()}
+        return self.directories[directory]
+
+    def add_time(self, directory, stage, seconds):
+        self._directory(directory)['stages'][stage] += seconds
+
+    def merge(self, other):
+        '''
+        Add in the data from another ``Stats``, or its ``to_dict()``.
+        '''
+        if isinstance(other, Stats):
+            other = other.to_dict()
+        for fname, counts in other['files'].items():
+            for k, n in counts.items():
+                self.count(fname, k, n)
+        for d, info in other['directories'].items():
+            mine = self._directory(d)
+            mine['seconds'] += info['seconds']
+            mine['stages'].update(info['stages'])
+            if 'peak_rss_mb' in info:
+                mine['peak_rss_mb'] = max(mine.get('peak_rss_mb', 0),
+                                          info['peak_rss_mb'])
+
+    def to_dict(self):
+        return {
+            'files' : {f : dict(c) for f, c in self.files.items()},
+            'directories' : {d : dict(info, stages=dict(info['stages']))
+                             for d, info in self.directories.items()},
+        }
+
+    def print_summary(self):
+        '''
+        Print a table of the counters for each file, and then one of the times
+        and memory use for each directory.
+        '''
+
+        short = {'records_filtered' : 'filtered',
+                 'partial_record_bytes' : 'partial',
+                 'ascii_decode_failures' : 'bad ascii',
+                 'bad_floats' : 'bad float',
+                 'species_pointers_out_of_range' : 'bad SPECIES ptr',
+                 'samples_pointers_out_of_range' : 'bad SAMPLES ptr',
+                 'sample2_misalignment' : 'SAMPLE2 offset'}
+
+        width = max([len(str(f)) for f in self.files] + [4])
+        print(('%-*s' % (width, 'file')) +
+              ''.join('%16s' % short.get(k, k) for k in COUNTERS))
+        for fname in sorted(self.files, key=str):
+            counts = self.files[fname]
+            print(('%-*s' % (width, fname)) +
+                  ''.join('%16d' % counts[k] for k in COUNTERS))
+
+        print()
+        width = max([len(d) for d in self.directories] + [9])
+        print(('%-*s' % (width, 'directory')) +
+              ''.join('%10s' % s for s in STAGES + ['total s', 'MB/s',
+                                                    'peak MB']))
+        for d in sorted(self.directories):
+            info = self.directories[d]
+            n_bytes = sum(c['bytes'] for f, c in self.files.items()
+                          if f is not None and path.dirname(f) == d.rstrip('/'))
+            rate = n_bytes/info['seconds']/1e6 if info['seconds'] else 0
+            print(('%-*s' % (width, d)) +
+                  ''.join('%10.3f' % info['stages'][s] for s in STAGES) +
+                  '%10.3f%10.2f%10s' % (info['seconds'], rate,
+                                        '%.1f' % info['peak_rss_mb']
+                                        if 'peak_rss_mb' in info else '-'))
+
+def active():
+    '''
+    The collector currently recording, or None.
+    '''
+    return _active
+
+@contextmanager
+def collect(stats=None):
+    '''
+    Record statistics for everything BUGOUT does inside the ``with`` block,
+    into ``stats`` or a new ``Stats``, which is returned.
+    '''
+    global _active
+    prev = _active
+    _active = stats if stats is not None else Stats()
+    try:
+        yield _active
+    finally:
+        _active = prev
+
+def count(filename, key, n=1):
+    '''
+    Add n to the counter ``key`` for a file. A ``filename`` of None means the
+    file most recently passed to ``reading``.
+    '''
+    if _active is not None:
+        _active.count(filename, key, n)
+
+def reading(filename):
+    '''
+    Note that decoding failures from now on come from ``filename``.
+    '''
+    if _active is not None:
+        _active._file = filename
+
+@contextmanager
+def directory(d):
+    '''
+    Record the total time spent on a directory, and the process's peak memory
+    use after it.
+    '''
+    if _active is None:
+        yield
+        return
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        info = _active._directory(d)
+        info['seconds'] += time.perf_counter() - t0
+        if resource is not None:
+            # ru_maxrss is in kB on Linux
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3
+            info['peak_rss_mb'] = max(info.get('peak_rss_mb', 0), rss)
+
+class StageTimer:
+    '''
+    Attribute the time spent on a directory to stages, by calling
+    ``switch(stage)`` whenever the work moves on to a new stage.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stage = None
+        self.t0 = time.perf_counter()
+
+    def switch(self, stage):
+        now = time.perf_counter()
+        if self.stage is not None and _active is not None:
+            _active.add_time(self.directory, self.stage, now - self.t0)
+        self.stage = stage
+        self.t0 = now
+
+    def stop(self):
+        self.switch(None)
+
+class _NoTimer:
+    def switch(self, stage):
+        pass
+
+    def stop(self):
+        pass
+
+def timer(directory):
+    '''
+    A ``StageTimer`` for directory, or one that does nothing if no statistics
+    are being collected.
+    '''
+    if _active is None:
+        return _NoTimer()
+    return StageTimer(directory)
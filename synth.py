@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Generate synthetic BUGIN directories, for testing and benchmarking without
+real well data.
+'''
+
+import random
+from os import makedirs, path
+from argparse import ArgumentParser
+
+from file_read import binary_types, ascii_types, convert_fields
+from file_read import parse_format_string
+
+def encode_record(file_type, values, rng):
+    '''
+    Encode one record of a binary BUGIN file.
+
+    Parameters
+    ----------
+
+    file_type : str
+        One of the keys of ``binary_types``.
+
+    values : dict
+        Field name to value. Missing fields are left blank.
+
+    rng : random.Random
+        Used to fill the uninitialized bytes that BUGIN leaves in ``X`` fields
+        and at the end of each record.
+    '''
+
+    d = convert_fields(binary_types[file_type])
+    b = bytearray()
+    for fmt, name in zip(parse_format_string(d['format_spec']),
+                         d['field_names']):
+        size = fmt['size']
+        val = values.get(name)
+
+        if fmt['type'] == 'X':
+            b += _junk(size, rng)
+        elif fmt['type'] == 'I':
+            b += (val or 0).to_bytes(size, 'little')
+        elif fmt['type'] == 'F':
+            s = '' if val is None else '%*.2f' % (size, val)
+            b += s[:size].rjust(size).encode('ASCII')
+        else:
+            s = '' if val is None else str(val)
+            b += s[:size].ljust(size).encode('ASCII')
+
+    b += _junk(d['record_length'] - len(b), rng)
+    return bytes(b)
+
+def _junk(n, rng):
+    # what BUGIN actually wrote there was whatever was left in memory; mostly
+    # blanks, with some chunks of old data
+    if rng.random() < 0.5:
+        return b' '*n
+    return bytes(rng.getrandbits(8) for _ in range(n))
+
+def make_well(directory, n_samples=100, n_species=200, n_abundance=2000,
+              sample2=True, seed=0):
+    '''
+    Write a synthetic set of BUGIN files (SAMPLES, SAMPLE2, SPECIES, ABUNDAN,
+    HEADER and USER) into directory, creating it if necessary.
+
+    Parameters
+    ----------
+
+    directory : str
+        Where to put the files.
+
+    n_samples, n_species, n_abundance : int
+        The number of data records in SAMPLES, SPECIES and ABUNDAN. Each file
+        also gets a first, header record, like real BUGIN files have.
+
+    sample2 : bool
+        Whether to write a SAMPLE2 file.
+
+    seed : int
+        Seed for the random number generator.
+    '''
+
+    rng = random.Random(seed)
+    makedirs(directory, exist_ok=True)
+
+    top = rng.uniform(1000, 5000)
+    samples = []
+    for i in range(n_samples+1):
+        samples.append({
+            'Sample Top' : top,
+            'Sample Bottom' : top + 30,
+            'Sample Index' : i,
+            'Sample Comment' : rng.choice(['', 'CUTTINGS', 'SWC, CORE']),
+            'Lithology Code' : rng.choice(['SH', 'SS', 'LS']),
+            'Lithology Data' : rng.choice(['', 'GRAY SHALE', 'SAND, FINE']),
+            'Age Code' : rng.choice(['MIO', 'PLIO', 'OLIG']),
+            'Zone Code' : 'Z%d' % rng.randrange(20),
+        })
+        top += 30
+
+    species = [{'Species Code' : '%07d' % i,
+                'Taxa' : 'Taxon %s %d' % (rng.choice(['alpha', 'beta']), i),
+                'Qualifier' : rng.choice(['', 'CF', 'AF']),
+                'Active/Not Active' : rng.choice(['A', 'N'])}
+               for i in range(n_species+1)]
+
+    abundance = [{'Frequency' : rng.choice(['1', '2', '5', '12', 'R', 'C']),
+                  'Pointer to SPECIES File' : rng.randrange(1, n_species+1),
+                  'Marker or Rework Flag' : rng.choice(['', '', '', 'R', 'M']),
+                  'Pointer to SAMPLES File' : rng.randrange(1, n_samples+1)}
+                 for _ in range(n_abundance+1)]
+
+    files = {'SAMPLES' : samples, 'SPECIES' : species, 'ABUNDAN' : abundance}
+    if sample2:
+        files['SAMPLE2'] = [{'Lithology' : 'Described lithology %d' % i,
+                             'Bathymetry' : rng.choice(['', 'OUTER NERITIC']),
+                             'Depositional Environment' : 'MARINE',
+                             'Zone Information 2' : ''}
+                            for i in range(n_samples)]
+
+    for file_type, records in files.items():
+        with open(path.join(directory, file_type), 'wb') as f:
+            for r in records:
+                f.write(encode_record(file_type, r, rng))
+
+    with open(path.join(directory, 'HEADER'), 'w') as f:
+        for name in ascii_types['HEADER']['field_names']:
+            f.write('%s %d\n' % (name.upper(), seed))
+
+    with open(path.join(directory, 'USER'), 'w') as f:
+        f.write('USER SPECIES\n')
+        for s in species[1:11]:
+            f.write('%-7s%-50s%-2s%-1s\n' % (s['Species Code'], s['Taxa'],
+                                             s['Qualifier'],
+                                             s['Active/Not Active']))
+            f.write(' '*10 + 'QUALIFIER\n')
+
+def make_dataset(root, n_wells=4, seed=0, **kwargs):
+    '''
+    Write ``n_wells`` synthetic BUGIN directories under root, named
+    "well000", "well001", etc. Every other well has no SAMPLE2 file. Extra
+    arguments are passed to ``make_well``.
+
+    Returns
+    -------
+
+    list of str
+        The directories that were written.
+    '''
+
+    dirs = []
+    for i in range(n_wells):
+        d = path.join(root, 'well%03d' % i)
+        make_well(d, sample2=(i % 2 == 0), seed=seed+i, **kwargs)
+        dirs.append(d)
+    return dirs
+
+if __name__ == '__main__':
+    p = ArgumentParser(description='Generate synthetic BUGIN directories.')
+
+    p.add_argument('root', help = 'Directory in which to create the wells.')
+
+    p.add_argument('--wells', type=int, default=4,
+                   help = 'Number of well directories to create.')
+
+    p.add_argument('--samples', type=int, default=100,
+                   help = 'Number of samples per well.')
+
+    p.add_argument('--species', type=int, default=200,
+                   help = 'Number of species per well.')
+
+    p.add_argument('--abundance', type=int, default=2000,
+                   help = 'Number of abundance records per well.')
+
+    p.add_argument('--seed', type=int, default=0,
+                   help = 'Random seed.')
+
+    args = p.parse_args()
+
+    make_dataset(args.root, args.wells, seed=args.seed,
+                 n_samples=args.samples, n_species=args.species,
+                 n_abundance=args.abundance)
@@ -0,0 +1,255 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Tests on synthetic BUGIN data (see ``synth``). Run with
+
+    python -m pytest test_bugout.py
+
+or ``python -m unittest test_bugout``.
+'''
+
+import os
+import gzip
+import random
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import cache
+import journal
+import prefetch
+from synth import make_well, make_dataset, encode_record
+from file_read import read_bugin
+from filters import Between
+from file_write import combine, gen_master_samples, merge_files
+from matrix import build_matrix
+from sinks import open_output, read_header, read_rows
+
+class TempDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='bugout_test_')
+        cache.invalidate()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+class TestRoundTrip(TempDirTest):
+
+    def test_encode_decode(self):
+        values = {
+            'Sample Top' : 1234.5,
+            'Sample Bottom' : 1264.5,
+            'Sample Index' : 7,
+            'Sample Comment' : 'SWC, CORE',
+            'Lithology Code' : 'SS',
+        }
+        fname = path.join(self.root, 'SAMPLES')
+        with open(fname, 'wb') as f:
+            f.write(encode_record('SAMPLES', values, random.Random(0)))
+
+        records, _ = read_bugin(self.root, 'SAMPLES')
+        self.assertEqual(len(records), 1)
+        d = dict(records[0])
+        for k, v in values.items():
+            self.assertEqual(d[k], v)
+
+    def test_read_well(self):
+        d = path.join(self.root, 'well')
+        make_well(d, n_samples=20, n_species=30, n_abundance=200, seed=1)
+
+        samples, _ = read_bugin(d, 'SAMPLES')
+        species, _ = read_bugin(d, 'SPECIES')
+        abundance, _ = read_bugin(d, 'ABUNDAN')
+
+        # each file has a header record before the data
+        self.assertEqual(len(samples), 21)
+        self.assertEqual(len(species), 31)
+        self.assertEqual(len(abundance), 201)
+
+        for i, r in enumerate(samples):
+            self.assertEqual(dict(r)['Sample Index'], i)
+        for i, r in enumerate(species):
+            self.assertEqual(dict(r)['Species Code'], '%07d' % i)
+        for r in abundance[1:]:
+            self.assertTrue(1 <= dict(r)['Pointer to SPECIES File'] <= 30)
+            self.assertTrue(1 <= dict(r)['Pointer to SAMPLES File'] <= 20)
+
+    def test_combine(self):
+        d = path.join(self.root, 'well')
+        make_well(d, n_samples=20, n_species=30, n_abundance=200, seed=2)
+        combine(d)
+
+        samples = [dict(r) for r in read_bugin(d, 'SAMPLES')[0]]
+        species = [dict(r) for r in read_bugin(d, 'SPECIES')[0]]
+        abundance = [dict(r) for r in read_bugin(d, 'ABUNDAN')[0]]
+
+        header, rows = _read_csv(path.join(d, 'clean_samples.csv'))
+        self.assertEqual(header[:2], ['Name', 'Source directory'])
+        self.assertEqual(len(rows), 20)
+        for s, row in zip(samples[1:], rows):
+            row = dict(zip(header, row))
+            self.assertEqual(row['Name'], 'well')
+            self.assertEqual(float(row['Sample Top']), s['Sample Top'])
+
+        header, rows = _read_csv(path.join(d, 'clean_abundance.csv'))
+        self.assertEqual(len(rows), 200)
+        for a, row in zip(abundance[1:], rows):
+            row = dict(zip(header, row))
+            self.assertEqual(row['Frequency'], a['Frequency'])
+            self.assertEqual(row['Taxa'],
+                             species[a['Pointer to SPECIES File']]['Taxa'])
+            sample = samples[a['Pointer to SAMPLES File']]
+            self.assertEqual(float(row['Sample Top']), sample['Sample Top'])
+
+    def test_combine_columns(self):
+        d = path.join(self.root, 'well')
+        make_well(d, n_samples=20, n_species=30, n_abundance=200, seed=3)
+        combine(d)
+        with open(path.join(d, 'clean_samples.csv'), 'rb') as f:
+            samples = f.read()
+
+        # clean_samples has none of these, so it's left alone
+        combine(d, fields=['Frequency', 'Taxa'])
+        with open(path.join(d, 'clean_samples.csv'), 'rb') as f:
+            self.assertEqual(f.read(), samples)
+        header, rows = _read_csv(path.join(d, 'clean_abundance.csv'))
+        self.assertEqual(header, ['Frequency', 'Taxa'])
+        self.assertEqual(len(rows), 200)
+
+class TestMatrix(TempDirTest):
+
+    def test_shape(self):
+        dirs = make_dataset(self.root, n_wells=2, n_samples=10, n_species=15,
+                            n_abundance=300)
+        m = build_matrix(dirs)
+
+        # SAMPLES' and SPECIES' first records aren't data
+        self.assertEqual(m.shape, (20, 15))
+        self.assertNotIn('%07d' % 0, m.codes())
+        self.assertEqual(len(m), 2*300)
+
+class TestCache(TempDirTest):
+
+    def test_filters_are_keyed_by_value(self):
+        d = path.join(self.root, 'well')
+        make_well(d, n_samples=20, n_species=10, n_abundance=10)
+
+        everything = [('Sample Index', lambda v: True)]
+        nothing = [('Sample Index', lambda v: False)]
+        self.assertEqual(len(read_bugin(d, 'SAMPLES', where=everything)[0]),
+                         21)
+        self.assertEqual(read_bugin(d, 'SAMPLES', where=nothing)[0], [])
+
+        a = read_bugin(d, 'SAMPLES', where=[('Sample Index', Between(1, 5))])
+        b = read_bugin(d, 'SAMPLES', where=[('Sample Index', Between(1, 5))])
+        self.assertEqual(len(a[0]), 5)
+        self.assertIs(a[0], b[0])
+
+class TestPrefetch(TempDirTest):
+
+    def test_changed_file_is_read_again(self):
+        dirs = make_dataset(self.root, n_wells=2, n_samples=10, n_species=10,
+                            n_abundance=10)
+        names = [path.join(d, 'SAMPLES') for d in dirs]
+
+        it = prefetch.ahead(dirs, ['SAMPLES'], depth=1)
+        self.assertEqual(next(it), dirs[0])
+        try:
+            # the first directory's file changes after it was read ahead
+            prefetch._store[names[0]][0].result()
+            with open(names[0], 'ab') as f:
+                f.write(b' '*200)
+
+            self.assertIsNone(prefetch.take(names[0]))
+            with open(names[1], 'rb') as f:
+                self.assertEqual(prefetch.take(names[1]), f.read())
+        finally:
+            it.close()
+
+class TestResume(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.dirs = make_dataset(self.root, n_wells=4, n_samples=50,
+                                 n_species=20, n_abundance=100)
+
+    def _interrupted(self, outfname, format):
+        '''
+        Leave outfname and its journal as a crash partway through merging
+        would: all directories converted, two of the files merged, part of
+        a third written, and a torn last journal entry.
+        '''
+        fnames = [path.join(d, 'clean_samples.' + format) for d in self.dirs]
+        j = journal.Journal(outfname + journal.EXTENSION)
+        for d in self.dirs:
+            j.record(directory=d)
+        merge_files(fnames[:2], outfname, format, journal=j)
+        j.close()
+
+        with open(outfname, 'ab') as f:
+            f.write(b'half a row,')
+        with open(outfname + journal.EXTENSION, 'a') as f:
+            f.write('{"file": "tor')
+
+    def _check_resume(self, format):
+        outfname = path.join(self.root, 'master.' + format)
+        gen_master_samples(self.dirs, outfname, format=format)
+        with open(outfname, 'rb') as f:
+            complete = f.read()
+        self.assertFalse(path.exists(outfname + journal.EXTENSION))
+
+        self._interrupted(outfname, format)
+        converted = [os.stat(path.join(d, 'clean_samples.' + format))
+                     .st_mtime_ns for d in self.dirs]
+
+        gen_master_samples(self.dirs, outfname, format=format, force=True,
+                           resume=True)
+
+        with open(outfname, 'rb') as f:
+            self.assertEqual(f.read(), complete)
+        self.assertFalse(path.exists(outfname + journal.EXTENSION))
+        # the journal said they were all converted, so --force didn't redo
+        # them
+        self.assertEqual([os.stat(path.join(d, 'clean_samples.' + format))
+                          .st_mtime_ns for d in self.dirs], converted)
+
+    def test_resume_csv(self):
+        self._check_resume('csv')
+
+    def test_resume_jsonl_gz(self):
+        self._check_resume('jsonl.gz')
+
+    def test_resume_without_journal(self):
+        # with nothing to resume from, the master file is written afresh
+        outfname = path.join(self.root, 'master.csv')
+        with open(outfname, 'w') as f:
+            f.write('stale\n')
+        gen_master_samples(self.dirs, outfname, resume=True)
+
+        header, rows = _read_csv(outfname)
+        self.assertEqual(header[:2], ['Name', 'Source directory'])
+        self.assertEqual(len(rows), 4*50)
+
+    def test_no_temporary_files(self):
+        outfname = path.join(self.root, 'master.csv.gz')
+        gen_master_samples(self.dirs, outfname, format='csv.gz')
+        with gzip.open(outfname, 'rt') as f:
+            self.assertEqual(len(f.readlines()), 4*50 + 1)
+
+        leftover = [f for _, _, files in os.walk(self.root) for f in files
+                    if f.endswith(('.tmp', journal.EXTENSION))]
+        self.assertEqual(leftover, [])
+
+def _read_csv(fname):
+    with open_output(fname) as f:
+        header = read_header(fname)
+        f.readline()
+        return header, list(read_rows(f))
+
+if __name__ == '__main__':
+    unittest.main()
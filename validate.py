@@ -8,12 +8,14 @@ Validate various data types.
 '''
 
 from os.path import isdir, isfile
+import archive
 
 def directories(dirs):
     rtn = []
     for d in dirs:
-        if not isdir(d):
-            raise ValueError('command line argument "%s" is not a directory.' % d)
+        if not archive.isdir(d):
+            raise ValueError('command line argument "%s" is not a directory '
+                             'or archive.' % d)
         else:
             rtn.append(d)
     return rtn
@@ -0,0 +1,136 @@
+'''
+This file is part of BUGOUT
+(c) Greg Meyer, 2018
+'''
+
+'''
+Keep directories' CSVs up to date as their BUGIN files change.
+'''
+
+import time
+from os import scandir, stat
+
+import archive
+import manifest
+from file_write import gen_master_samples
+
+# seconds between checks for changes
+INTERVAL = 1.0
+
+# seconds to wait after the last change to a directory before rebuilding it,
+# so that saving several files only triggers one rebuild
+DEBOUNCE = 2.0
+
+def snapshot(dirs, names):
+    '''
+    The size and modification time of each of the files ``names`` in each of
+    dirs, from one ``scandir`` per directory. For directories in archives,
+    that of the archive.
+    '''
+
+    rtn = {}
+    for d in dirs:
+        state = []
+        try:
+            s = archive.split(d)
+            if s is not None:
+                st = stat(s[0])
+                state.append((s[0], st.st_size, st.st_mtime_ns))
+            else:
+                with scandir(d) as it:
+                    for entry in it:
+                        if entry.name in names:
+                            st = entry.stat()
+                            state.append((entry.name, st.st_size,
+                                          st.st_mtime_ns))
+        except OSError:
+            # e.g. the directory is being replaced; try again next time
+            pass
+        rtn[d] = sorted(state)
+    return rtn
+
+def watch(dirs, convert, target, master=None, content_hash=False,
+          format='csv', where=None, fields=None, interval=INTERVAL,
+          debounce=DEBOUNCE):
+    '''
+    Convert the directories that are out of date, then keep watching them and
+    reconvert each one whenever its BUGIN files change. Runs until
+    interrupted.
+
+    Parameters
+    ----------
+
+    dirs : list of str
+        The directories to watch.
+
+    convert : function
+        Called as ``convert(directory)`` to convert a directory (i.e.
+        ``combine`` or ``parse_and_write``).
+
+    target : str
+        The kind of output ``convert`` produces (see ``manifest.TARGETS``).
+
+    master : str
+        If given, regenerate this master samples file after each rebuild.
+
+    content_hash : bool
+        Passed on to ``manifest.build``; with it, files that are saved again
+        without changes don't trigger a rebuild.
+
+    format : str
+        The output format (see ``sinks.sinks``).
+
+    where : dict
+        Filters for the records to convert (see ``filters``).
+
+    fields : list of str
+        If given, only output these columns.
+
+    interval : float
+        Seconds between checks for changes.
+
+    debounce : float
+        Seconds to wait after the last change to a directory before
+        reconverting it.
+    '''
+
+    names = set(manifest.TARGETS[target][0])
+
+    for d in dirs:
+        manifest.build(d, convert, target, content_hash=content_hash,
+                       format=format, where=where, fields=fields)
+    if master:
+        gen_master_samples(dirs, master, content_hash=content_hash,
+                           format=format, where=where, fields=fields)
+
+    print('Watching %d directories for changes. Press Ctrl-C to stop.'
+          % len(dirs))
+
+    last = snapshot(dirs, names)
+    changed = {}
+    try:
+        while True:
+            time.sleep(interval)
+
+            now = time.monotonic()
+            current = snapshot(dirs, names)
+            for d in dirs:
+                if current[d] != last[d]:
+                    changed[d] = now
+            last = current
+
+            ready = [d for d, t in changed.items() if now - t >= debounce]
+            for d in ready:
+                del changed[d]
+                print('%s: %s changed, rebuilding...'
+                      % (time.strftime('%H:%M:%S'), d))
+                manifest.build(d, convert, target, content_hash=content_hash,
+                               format=format, where=where, fields=fields)
+
+            if ready and master:
+                gen_master_samples(dirs, master, content_hash=content_hash,
+                                   format=format, where=where,
+                                   fields=fields)
+
+    except KeyboardInterrupt:
+        print()